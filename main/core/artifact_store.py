@@ -0,0 +1,178 @@
+import glob
+import io
+import os
+import queue
+import threading
+import time
+import wave
+from collections import deque, namedtuple
+from datetime import datetime
+
+# An audio clip or transcript produced during an interaction
+#   kind:    e.g. "recording", "transcription", "tts_output"
+#   data:    bytes (audio) or str (text)
+#   created: time.time() when the artifact was stored
+#   path:    file it is (being) persisted to, or None if it only lives in memory
+Artifact = namedtuple("Artifact", "kind data created path")
+
+# File extension used when persisting each kind of artifact
+EXTENSIONS = {
+    "recording": "wav",
+    "tts_output": "wav",
+    "transcription": "txt",
+}
+
+
+def pcm_to_wav(pcm, sample_rate=16000, channels=1, sample_width=2):
+    """
+    Wrap raw PCM in a WAV header, in memory
+
+    Args:
+        pcm (bytes): Raw PCM samples
+        sample_rate (int): Sample rate in Hz
+        channels (int): Number of channels
+        sample_width (int): Bytes per sample
+
+    Returns:
+        bytes: WAV file contents
+    """
+    buffer = io.BytesIO()
+    wf = wave.open(buffer, 'wb')
+    wf.setnchannels(channels)
+    wf.setsampwidth(sample_width)
+    wf.setframerate(sample_rate)
+    wf.writeframes(pcm)
+    wf.close()
+    return buffer.getvalue()
+
+
+class ArtifactStore:
+    """
+    In-memory store for audio and transcripts with optional background persistence
+
+    The latest artifacts of each kind are kept in memory (bounded by
+    max_items). When persist_dir is set, artifacts are also queued to a
+    single writer thread, so the interaction itself never waits on the disk;
+    only the newest max_files files of each kind are kept.
+    """
+
+    def __init__(self, persist_dir=None, persist_kinds=None, max_items=10, max_files=20,
+                 debug_mode=False):
+        """
+        Initialize the artifact store
+
+        Args:
+            persist_dir (str): Directory to write artifacts to (None keeps them in memory only)
+            persist_kinds (iterable): Kinds to persist (None persists every kind)
+            max_items (int): Artifacts of each kind kept in memory
+            max_files (int): Files of each kind kept on disk
+            debug_mode (bool): Enable debug logging
+        """
+        self.persist_dir = persist_dir
+        self.persist_kinds = set(persist_kinds) if persist_kinds is not None else None
+        self.max_items = max_items
+        self.max_files = max_files
+        self.debug_mode = debug_mode
+
+        self._lock = threading.Lock()
+        self._artifacts = {}
+        self._queue = queue.Queue()
+        self._writer = None
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"ARTIFACT DEBUG: {message}")
+
+    def put(self, kind, data):
+        """
+        Store an artifact and queue it for persistence if configured
+
+        Args:
+            kind (str): Artifact kind, e.g. "recording"
+            data (bytes or str): Audio bytes or transcript text
+
+        Returns:
+            Artifact: The stored artifact
+        """
+        created = time.time()
+        path = None
+        if self._should_persist(kind):
+            stamp = datetime.fromtimestamp(created).strftime("%Y%m%d_%H%M%S_%f")
+            path = os.path.join(self.persist_dir, f"{kind}_{stamp}.{EXTENSIONS.get(kind, 'bin')}")
+
+        artifact = Artifact(kind, data, created, path)
+        with self._lock:
+            self._artifacts.setdefault(kind, deque(maxlen=self.max_items)).append(artifact)
+
+        if path is not None:
+            self._start_writer()
+            self._queue.put(artifact)
+        return artifact
+
+    def latest(self, kind):
+        """
+        Get the newest artifact of a kind
+
+        Returns:
+            Artifact: The newest artifact, or None
+        """
+        with self._lock:
+            items = self._artifacts.get(kind)
+            return items[-1] if items else None
+
+    def history(self, kind):
+        """
+        Get the artifacts of a kind still held in memory, oldest first
+
+        Returns:
+            list: Artifact objects
+        """
+        with self._lock:
+            return list(self._artifacts.get(kind, []))
+
+    def flush(self):
+        """Block until every queued artifact has been written"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def _should_persist(self, kind):
+        if self.persist_dir is None:
+            return False
+        return self.persist_kinds is None or kind in self.persist_kinds
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is not None:
+                return
+            os.makedirs(self.persist_dir, exist_ok=True)
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            artifact = self._queue.get()
+            try:
+                if isinstance(artifact.data, str):
+                    with open(artifact.path, "w", encoding='utf-8') as f:
+                        f.write(artifact.data)
+                else:
+                    with open(artifact.path, "wb") as f:
+                        f.write(artifact.data)
+                self.log(f"Saved {artifact.path}")
+                self._prune(artifact.kind)
+            except Exception as e:
+                print(f"Error saving {artifact.kind}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _prune(self, kind):
+        """Delete the oldest files of a kind beyond max_files"""
+        pattern = os.path.join(self.persist_dir, f"{kind}_*.{EXTENSIONS.get(kind, 'bin')}")
+        files = sorted(glob.glob(pattern))
+        for old_file in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(old_file)
+                self.log(f"Deleted old artifact: {old_file}")
+            except Exception as e:
+                self.log(f"Could not delete file {old_file}: {e}")
@@ -0,0 +1,120 @@
+from collections import namedtuple
+
+# Named set of Whisper decoding settings
+#   model:          Whisper model size, e.g. "small" or "base.en"
+#   beam_size:      Beam width, or None for greedy decoding
+#   fallback:       Retry at higher temperatures when the output looks wrong
+#                   (repetitive or low confidence); each retry is a full decode
+#   threads:        PyTorch CPU threads (None leaves the default)
+#   initial_prompt: Prime the decoder with device names and color words
+DecodingProfile = namedtuple("DecodingProfile", "name model beam_size fallback threads initial_prompt")
+
+# Words that appear in commands and that Whisper tends to misspell without context
+DEVICE_NAMES = ["WiZ light", "RGB light", "TV"]
+COLOR_WORDS = ["red", "orange", "yellow", "green", "cyan", "blue", "purple", "pink", "white",
+               "warm white", "rainbow", "brightness", "percent"]
+
+# Whisper's own retry schedule, used when fallback is enabled
+FALLBACK_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+PROFILES = {
+    # What SpeechRecognizer always used: Whisper's long-form defaults
+    "default": DecodingProfile("default", "small", None, True, None, False),
+    # English-only model with beam search and a primed decoder
+    "accurate": DecodingProfile("accurate", "small.en", 5, True, None, True),
+    # One greedy pass: on two-second commands fallback rarely changes the
+    # result but multiplies the worst-case latency
+    "balanced": DecodingProfile("balanced", "small.en", None, False, None, True),
+    "fast": DecodingProfile("fast", "base.en", None, False, None, True),
+    "fastest": DecodingProfile("fastest", "tiny.en", None, False, None, True),
+    # Small models gain little from many threads, and fewer threads leave
+    # cores free for the rest of the assistant
+    "fast@2": DecodingProfile("fast@2", "base.en", None, False, 2, True),
+    "fast@4": DecodingProfile("fast@4", "base.en", None, False, 4, True),
+    "balanced@4": DecodingProfile("balanced@4", "small.en", None, False, 4, True),
+}
+
+
+def build_initial_prompt(devices=DEVICE_NAMES, colors=COLOR_WORDS):
+    """
+    Build the decoder prompt that biases Whisper towards command vocabulary
+
+    Args:
+        devices (list): Device names
+        colors (list): Color and setting words
+
+    Returns:
+        str: The prompt
+    """
+    return f"Smart home commands for the {', '.join(devices)}: {', '.join(colors)}."
+
+
+def get_profile(profile):
+    """
+    Look up a decoding profile
+
+    A name of the form "<profile>@<threads>", e.g. "fast@8", gives the
+    profile with that thread count even if it is not listed in PROFILES.
+
+    Args:
+        profile (str or DecodingProfile): Profile name or the profile itself
+
+    Returns:
+        DecodingProfile: The profile
+    """
+    if isinstance(profile, DecodingProfile):
+        return profile
+    if profile in PROFILES:
+        return PROFILES[profile]
+    base, _, threads = profile.partition("@")
+    if base in PROFILES and threads.isdigit() and int(threads) > 0:
+        return PROFILES[base]._replace(name=profile, threads=int(threads))
+    raise ValueError(f"Unknown ASR profile '{profile}' (choose from {', '.join(PROFILES)}, "
+                     f"optionally with @<threads>)")
+
+
+def with_threads(profile, threads):
+    """
+    Variant of a profile with a different PyTorch thread count
+
+    Args:
+        profile (str or DecodingProfile): The base profile
+        threads (int): Thread count
+
+    Returns:
+        DecodingProfile: The variant, named "<profile>@<threads>"
+    """
+    profile = get_profile(profile)
+    base = profile.name.partition("@")[0]
+    return get_profile(f"{base}@{threads}")
+
+
+def transcribe_options(profile, use_fp16=False):
+    """
+    Keyword arguments for whisper's model.transcribe() for a profile
+
+    Args:
+        profile (DecodingProfile): The profile
+        use_fp16 (bool): Decode in half precision (only useful on a GPU)
+
+    Returns:
+        dict: Options to pass to model.transcribe()
+    """
+    if profile.name.partition("@")[0] == "default":
+        # Leave everything but the language to Whisper, as before profiles existed
+        return {"language": "en", "fp16": use_fp16}
+
+    options = {
+        "language": "en",
+        "fp16": use_fp16,
+        # A command is a single 30 s window, so there is no earlier text to condition on
+        "condition_on_previous_text": False,
+        "without_timestamps": True,
+    }
+    # A single temperature means a single decode, whatever the output looks like
+    options["temperature"] = FALLBACK_TEMPERATURES if profile.fallback else 0.0
+    if profile.beam_size:
+        options["beam_size"] = profile.beam_size
+    if profile.initial_prompt:
+        options["initial_prompt"] = build_initial_prompt()
+    return options
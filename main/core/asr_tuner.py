@@ -0,0 +1,202 @@
+"""
+Pick the fastest ASR decoding profile that is accurate enough
+
+Usage:
+    python asr_tuner.py path/to/corpus --max-wer 0.05
+    python asr_tuner.py path/to/corpus --profiles fast balanced --threads 1 2 4 8
+
+The corpus is a directory of recorded commands: each WAV file has a .txt
+file with the same name holding what was said, e.g. blue_light.wav and
+blue_light.txt ("Turn the light blue"). Every profile in asr_profiles
+(or the ones given with --profiles) transcribes the whole corpus; the
+profile with the lowest mean latency whose word error rate is at or
+below the target wins. With --threads each profile is also tried with
+those PyTorch thread counts (as "<profile>@<threads>"). Set ASR_PROFILE
+in run.py to the winning name to use it.
+"""
+import argparse
+import glob
+import os
+import re
+import statistics
+import time
+
+import torch
+import whisper
+
+from asr_profiles import PROFILES, get_profile, transcribe_options, with_threads
+
+
+def normalize_text(text):
+    """Lowercase and strip punctuation so only word differences count"""
+    return re.sub(r"[^a-z0-9' ]+", " ", text.lower()).split()
+
+
+def word_errors(reference, hypothesis):
+    """
+    Count the word-level edits between two transcripts
+
+    Args:
+        reference (str): What was said
+        hypothesis (str): What was transcribed
+
+    Returns:
+        tuple: (edits, reference_words) - substitutions + insertions + deletions,
+               and the number of words in the reference
+    """
+    ref = normalize_text(reference)
+    hyp = normalize_text(hypothesis)
+    # Levenshtein distance over words, one row at a time
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1], len(ref)
+
+
+def load_corpus(directory):
+    """
+    Load the labelled command recordings
+
+    Args:
+        directory (str): Directory with <name>.wav and <name>.txt pairs
+
+    Returns:
+        list: (name, audio, reference) tuples; audio is 16 kHz float32 as Whisper expects
+    """
+    corpus = []
+    for wav_path in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+        label_path = os.path.splitext(wav_path)[0] + ".txt"
+        if not os.path.exists(label_path):
+            print(f"Skipping {wav_path}: no {os.path.basename(label_path)}")
+            continue
+        with open(label_path, "r", encoding="utf-8") as f:
+            reference = f.read().strip()
+        corpus.append((os.path.basename(wav_path), whisper.load_audio(wav_path), reference))
+    return corpus
+
+
+def evaluate_profile(profile, corpus, models=None, debug_mode=False):
+    """
+    Transcribe the corpus with one profile and measure latency and accuracy
+
+    Args:
+        profile (DecodingProfile): The profile to evaluate
+        corpus (list): Output of load_corpus()
+        models (dict): Cache of loaded Whisper models by name, shared between profiles
+        debug_mode (bool): Print every transcription
+
+    Returns:
+        dict: name, model, wer, mean_ms, p95_ms and max_ms
+    """
+    if models is None:
+        models = {}
+    if profile.model not in models:
+        print(f"Loading Whisper model '{profile.model}'...")
+        models[profile.model] = whisper.load_model(profile.model)
+    model = models[profile.model]
+
+    default_threads = torch.get_num_threads()
+    if profile.threads:
+        torch.set_num_threads(profile.threads)
+    options = transcribe_options(profile, torch.cuda.is_available())
+    try:
+        # Warm up so the first clip doesn't carry one-off setup costs
+        model.transcribe(corpus[0][1], **options)
+
+        latencies = []
+        edits = 0
+        words = 0
+        for name, audio, reference in corpus:
+            started = time.perf_counter()
+            text = model.transcribe(audio, **options)["text"]
+            latencies.append((time.perf_counter() - started) * 1000)
+            clip_edits, clip_words = word_errors(reference, text)
+            edits += clip_edits
+            words += clip_words
+            if debug_mode and clip_edits:
+                print(f"  {name}: expected '{reference}', got '{text.strip()}'")
+    finally:
+        torch.set_num_threads(default_threads)
+
+    ordered = sorted(latencies)
+    return {
+        "name": profile.name,
+        "model": profile.model,
+        "wer": edits / words if words else 0.0,
+        "mean_ms": statistics.mean(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_ms": ordered[-1],
+    }
+
+
+def tune(corpus_dir, max_wer=0.05, profiles=None, threads=None, debug_mode=False):
+    """
+    Evaluate decoding profiles on a corpus and choose one
+
+    Args:
+        corpus_dir (str): Directory of labelled command WAVs (see load_corpus)
+        max_wer (float): Highest acceptable word error rate, e.g. 0.05 for 5%
+        profiles (list): Profile names or DecodingProfile objects (None tries all)
+        threads (list): Thread counts to try each profile with (None uses each
+                        profile's own setting)
+        debug_mode (bool): Print every misrecognized clip
+
+    Returns:
+        tuple: (best, results) - the result dict of the chosen profile (None if
+               none meets the target) and the results of every profile
+    """
+    corpus = load_corpus(corpus_dir)
+    if not corpus:
+        raise ValueError(f"No labelled WAV files found in {corpus_dir}")
+    print(f"Corpus: {len(corpus)} recordings")
+
+    candidates = [get_profile(profile) for profile in (profiles or list(PROFILES))]
+    if threads:
+        # The same decoding settings at each thread count, without duplicates
+        candidates = list({with_threads(profile, count).name: with_threads(profile, count)
+                           for profile in candidates for count in threads}.values())
+
+    models = {}
+    results = []
+    for profile in candidates:
+        print(f"Evaluating profile '{profile.name}'...")
+        results.append(evaluate_profile(profile, corpus, models, debug_mode))
+
+    print(f"\n{'profile':<14}{'model':<10}{'WER':>8}{'mean':>11}{'p95':>11}{'max':>11}")
+    print("-" * 65)
+    for result in sorted(results, key=lambda r: r["mean_ms"]):
+        print(f"{result['name']:<14}{result['model']:<10}{result['wer'] * 100:>7.1f}%"
+              f"{result['mean_ms']:>8.0f} ms{result['p95_ms']:>8.0f} ms{result['max_ms']:>8.0f} ms")
+
+    accurate = [result for result in results if result["wer"] <= max_wer]
+    if not accurate:
+        print(f"\nNo profile reaches a WER of {max_wer * 100:.1f}% or less")
+        return None, results
+    best = min(accurate, key=lambda r: r["mean_ms"])
+    print(f"\nFastest profile within {max_wer * 100:.1f}% WER: '{best['name']}' "
+          f"({best['mean_ms']:.0f} ms mean, {best['wer'] * 100:.1f}% WER)")
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Choose the fastest accurate ASR profile")
+    parser.add_argument("corpus", help="Directory of <name>.wav recordings with <name>.txt labels")
+    parser.add_argument("--max-wer", type=float, default=0.05,
+                        help="Highest acceptable word error rate (default: 0.05)")
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES),
+                        help="Profiles to evaluate (default: all)")
+    parser.add_argument("--threads", nargs="+", type=int,
+                        help="PyTorch thread counts to try each profile with, e.g. 1 2 4 8")
+    parser.add_argument("--debug", action="store_true", help="Show misrecognized clips")
+    args = parser.parse_args()
+    tune(args.corpus, max_wer=args.max_wer, profiles=args.profiles, threads=args.threads,
+         debug_mode=args.debug)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+import struct
+import threading
+import time
+import pyaudio
+
+# Audio is written to the output stream in blocks of this many frames
+DEFAULT_FRAMES_PER_BUFFER = 1024
+# How much PCM to buffer before opening the output stream (seconds)
+DEFAULT_PREBUFFER_SECONDS = 0.1
+
+
+class WavStreamParser:
+    """
+    Incremental WAV header parser
+
+    Accepts audio bytes in arbitrary pieces (e.g. chunks of a streamed HTTP
+    response) and separates the RIFF header from the PCM payload. The size
+    fields of the header are ignored, because streaming servers such as
+    GPT-SoVITS send a header before the total length is known.
+    """
+
+    def __init__(self, raw_format=None):
+        """
+        Initialize the parser
+
+        Args:
+            raw_format (dict): Format to assume when the data has no RIFF header,
+                e.g. {"channels": 1, "sample_rate": 32000, "sample_width": 2}.
+                If None, headerless data is rejected.
+        """
+        self.raw_format = raw_format
+        self.format = None
+        self._header = bytearray()
+
+    def feed(self, data):
+        """
+        Feed more bytes into the parser
+
+        Args:
+            data (bytes): Next piece of the audio stream
+
+        Returns:
+            bytes: PCM payload contained in data (empty while the header is incomplete)
+        """
+        if self.format is not None:
+            return data
+
+        self._header.extend(data)
+        if len(self._header) < 12:
+            return b""
+
+        if self._header[:4] != b"RIFF" or self._header[8:12] != b"WAVE":
+            if self.raw_format is None:
+                raise ValueError("Audio data is not a WAV stream")
+            self.format = dict(self.raw_format)
+            self.format.setdefault("audio_format", 1)
+            pcm = bytes(self._header)
+            self._header = bytearray()
+            return pcm
+
+        fmt = None
+        pos = 12
+        while pos + 8 <= len(self._header):
+            chunk_id = bytes(self._header[pos:pos + 4])
+            chunk_size = struct.unpack("<I", self._header[pos + 4:pos + 8])[0]
+
+            if chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("WAV data chunk found before fmt chunk")
+                self.format = fmt
+                pcm = bytes(self._header[pos + 8:])
+                self._header = bytearray()
+                return pcm
+
+            chunk_end = pos + 8 + chunk_size + (chunk_size % 2)
+            if chunk_id == b"fmt ":
+                if len(self._header) < pos + 8 + 16:
+                    break
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack(
+                    "<HHIIHH", self._header[pos + 8:pos + 24]
+                )
+                fmt = {
+                    "audio_format": audio_format,
+                    "channels": channels,
+                    "sample_rate": sample_rate,
+                    "sample_width": bits // 8,
+                }
+            pos = chunk_end
+
+        return b""
+
+
+class Playback:
+    """
+    Handle for a single playback on an AudioPlayer
+
+    Audio bytes are pushed in with write() and played by a PortAudio callback
+    running on its own thread, so the caller never blocks on the sound card.
+    Call close() once all data has been written, stop() to cut playback short
+    and wait() to block until the audio has finished.
+    """
+
+    def __init__(self, pa, raw_format=None, prebuffer_seconds=DEFAULT_PREBUFFER_SECONDS,
+                 frames_per_buffer=DEFAULT_FRAMES_PER_BUFFER, log=None):
+        self._pa = pa
+        self._parser = WavStreamParser(raw_format)
+        self._prebuffer_seconds = prebuffer_seconds
+        self._frames_per_buffer = frames_per_buffer
+        self._log = log or (lambda message: None)
+
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._stream = None
+        self._frame_size = 0
+        self._silence = b"\x00"
+        self._input_closed = False
+        self._stopped = False
+        self._drained = threading.Event()
+        self._done = threading.Event()
+
+        # Timing information
+        self.created_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self.underruns = 0
+
+    @property
+    def start_latency(self):
+        """Seconds between creating the playback and the first audio callback"""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.created_at
+
+    def write(self, data):
+        """
+        Append audio bytes to the playback
+
+        Args:
+            data (bytes): WAV bytes (header first) or raw PCM for headerless streams
+        """
+        if self._stopped or self._input_closed or not data:
+            return
+
+        try:
+            pcm = self._parser.feed(data)
+        except ValueError as e:
+            print(f"Error playing audio: {e}")
+            self.stop()
+            return
+
+        with self._lock:
+            self._buffer.extend(pcm)
+            buffered = len(self._buffer)
+
+        if self._stream is None and self._parser.format is not None:
+            fmt = self._parser.format
+            prebuffer = int(self._prebuffer_seconds * fmt["sample_rate"]) * \
+                fmt["channels"] * fmt["sample_width"]
+            if buffered >= prebuffer:
+                self._open_stream()
+
+    def close(self):
+        """Mark the end of the input; playback continues until the buffer is empty"""
+        self._input_closed = True
+        if self._stream is None:
+            if self._parser.format is not None and self._buffer and not self._stopped:
+                self._open_stream()
+            else:
+                self._finish()
+
+    def stop(self):
+        """Stop playback immediately and discard any buffered audio"""
+        with self._lock:
+            self._stopped = True
+            self._buffer.clear()
+        if self._stream is None:
+            self._finish()
+
+    def wait(self, timeout=None):
+        """
+        Block until playback has finished or was stopped
+
+        Args:
+            timeout (float): Maximum number of seconds to wait (None waits forever)
+
+        Returns:
+            bool: True if playback finished, False on timeout
+        """
+        return self._done.wait(timeout)
+
+    def is_playing(self):
+        """Return True while the playback has not finished"""
+        return not self._done.is_set()
+
+    def _open_stream(self):
+        fmt = self._parser.format
+        if fmt["audio_format"] == 3:
+            sample_format = pyaudio.paFloat32
+        else:
+            sample_format = self._pa.get_format_from_width(fmt["sample_width"])
+        self._frame_size = fmt["channels"] * fmt["sample_width"]
+        # 8-bit WAV is unsigned, so its silence is the midpoint
+        self._silence = b"\x80" if fmt["sample_width"] == 1 else b"\x00"
+
+        try:
+            self._stream = self._pa.open(format=sample_format,
+                                         channels=fmt["channels"],
+                                         rate=fmt["sample_rate"],
+                                         output=True,
+                                         frames_per_buffer=self._frames_per_buffer,
+                                         stream_callback=self._callback)
+        except Exception as e:
+            print(f"Error opening audio output: {e}")
+            self._finish()
+            return
+
+        self._log(f"Opened output stream: {fmt}")
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+
+        wanted = frame_count * self._frame_size
+        with self._lock:
+            if self._stopped:
+                self._drained.set()
+                return (b"", pyaudio.paAbort)
+
+            if len(self._buffer) >= wanted:
+                data = bytes(self._buffer[:wanted])
+                del self._buffer[:wanted]
+                if self._input_closed and not self._buffer:
+                    self._drained.set()
+                    return (data, pyaudio.paComplete)
+                return (data, pyaudio.paContinue)
+
+            # Not enough data: only consume whole frames and pad with silence
+            available = len(self._buffer) - len(self._buffer) % self._frame_size
+            data = bytes(self._buffer[:available])
+            del self._buffer[:available]
+            data += self._silence * (wanted - available)
+
+            if self._input_closed:
+                self._drained.set()
+                return (data, pyaudio.paComplete)
+
+            self.underruns += 1
+            return (data, pyaudio.paContinue)
+
+    def _watch(self):
+        """Close the output stream once the callback has signalled completion"""
+        self._drained.wait()
+        try:
+            # Let the device play out the last buffer
+            while self._stream.is_active():
+                time.sleep(0.01)
+            self._stream.close()
+        except Exception as e:
+            self._log(f"Error closing output stream: {e}")
+        self._finish()
+
+    def _finish(self):
+        if not self._done.is_set():
+            self.finished_at = time.perf_counter()
+            self._log(f"Playback finished (start latency: {self.start_latency}, "
+                      f"underruns: {self.underruns})")
+            self._done.set()
+
+
+class AudioPlayer:
+    """
+    Non-blocking audio player built on a PyAudio callback stream
+
+    Only one playback is active at a time; starting a new one stops the
+    previous one. Playback starts as soon as enough PCM has arrived, so a
+    chunked response can be played while it is still being downloaded.
+    """
+
+    def __init__(self, prebuffer_seconds=DEFAULT_PREBUFFER_SECONDS, debug_mode=False):
+        """
+        Initialize the audio player
+
+        Args:
+            prebuffer_seconds (float): Audio to buffer before the output stream starts
+            debug_mode (bool): Enable debug logging
+        """
+        self.prebuffer_seconds = prebuffer_seconds
+        self.debug_mode = debug_mode
+        self.current = None
+        self._lock = threading.Lock()
+        self._pa = pyaudio.PyAudio()
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"AUDIO DEBUG: {message}")
+
+    def open_stream(self, raw_format=None):
+        """
+        Start a new playback that is fed incrementally with Playback.write()
+
+        Args:
+            raw_format (dict): Format of headerless PCM data (optional)
+
+        Returns:
+            Playback: Handle of the new playback
+        """
+        playback = Playback(self._pa, raw_format=raw_format,
+                            prebuffer_seconds=self.prebuffer_seconds, log=self.log)
+        with self._lock:
+            previous, self.current = self.current, playback
+        if previous is not None:
+            previous.stop()
+        return playback
+
+    def play_bytes(self, audio_data):
+        """
+        Play a complete WAV file held in memory
+
+        Args:
+            audio_data (bytes): WAV data
+
+        Returns:
+            Playback: Handle of the new playback
+        """
+        playback = self.open_stream()
+        playback.write(audio_data)
+        playback.close()
+        return playback
+
+    def play_chunks(self, chunks, raw_format=None):
+        """
+        Play audio from an iterable of byte chunks, consumed on a background thread
+
+        Args:
+            chunks (iterable): Iterable yielding bytes, e.g. response.iter_content()
+            raw_format (dict): Format of headerless PCM data (optional)
+
+        Returns:
+            Playback: Handle of the new playback
+        """
+        playback = self.open_stream(raw_format=raw_format)
+
+        def feed():
+            try:
+                for chunk in chunks:
+                    if not playback.is_playing():
+                        break
+                    playback.write(chunk)
+            except Exception as e:
+                print(f"Error reading audio stream: {e}")
+            finally:
+                playback.close()
+
+        threading.Thread(target=feed, daemon=True).start()
+        return playback
+
+    def play_file(self, audio_file, chunk_size=65536):
+        """
+        Play a WAV file from disk
+
+        Args:
+            audio_file (str): Path to the audio file
+            chunk_size (int): Number of bytes read at a time
+
+        Returns:
+            Playback: Handle of the new playback
+        """
+        def read_chunks():
+            with open(audio_file, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        return self.play_chunks(read_chunks())
+
+    def stop(self):
+        """Stop the current playback, if any"""
+        with self._lock:
+            playback = self.current
+        if playback is not None:
+            playback.stop()
+
+    def wait(self, timeout=None):
+        """
+        Block until the current playback has finished
+
+        Args:
+            timeout (float): Maximum number of seconds to wait (None waits forever)
+
+        Returns:
+            bool: True if nothing is playing anymore, False on timeout
+        """
+        with self._lock:
+            playback = self.current
+        if playback is None:
+            return True
+        return playback.wait(timeout)
+
+    def is_playing(self):
+        """Return True while audio is playing"""
+        with self._lock:
+            playback = self.current
+        return playback is not None and playback.is_playing()
+
+    def close(self):
+        """Stop playback and release the audio device"""
+        self.stop()
+        self.wait(timeout=1.0)
+        self._pa.terminate()
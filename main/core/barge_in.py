@@ -0,0 +1,200 @@
+import threading
+import time
+from array import array
+import keyboard
+import pyaudio
+
+
+def frame_rms(data):
+    """
+    Compute the RMS level of a block of 16-bit mono PCM
+
+    Args:
+        data (bytes): Little-endian 16-bit PCM samples
+
+    Returns:
+        float: Root mean square of the samples (0-32768)
+    """
+    samples = array("h")
+    samples.frombytes(data[:len(data) - len(data) % 2])
+    if not samples:
+        return 0.0
+    return (sum(s * s for s in samples) / len(samples)) ** 0.5
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation flag shared between the orchestrator and workers
+
+    Workers check is_cancelled() between steps; blocking operations (HTTP
+    streams, audio playback) register a callback with add_callback() so they
+    are torn down the moment cancel() is called.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self):
+        """Cancel the token and run all registered callbacks"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in cancellation callback: {e}")
+
+    def is_cancelled(self):
+        """Return True once cancel() has been called"""
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Sleep until the token is cancelled or the timeout expires
+
+        Args:
+            timeout (float): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if the token was cancelled
+        """
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback):
+        """
+        Register a function to run on cancellation
+
+        If the token is already cancelled the callback runs immediately.
+
+        Args:
+            callback (callable): Function taking no arguments
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class BargeInMonitor:
+    """
+    Detects the user interrupting while the assistant is busy or speaking
+
+    A barge-in is either a key press or sustained speech picked up by the
+    microphone. When speech triggers the barge-in, the audio recorded since
+    the speech started is kept in captured_frames so the new command can be
+    transcribed without losing its first words.
+
+    Without a headset the microphone also hears the assistant itself. While
+    the assistant is playing audio (and for echo_tail_seconds afterwards),
+    only blocks louder than playback_threshold count as speech; by default
+    the microphone is ignored during playback altogether.
+    """
+
+    def __init__(self, keys=("space",), detect_speech=True, speech_threshold=1500,
+                 min_speech_seconds=0.3, sample_rate=16000, chunk=1024, playback_threshold=None,
+                 echo_tail_seconds=0.3, debug_mode=False):
+        """
+        Initialize the barge-in monitor
+
+        Args:
+            keys (tuple): Keys that interrupt the assistant
+            detect_speech (bool): Whether speech on the microphone interrupts the assistant
+            speech_threshold (float): RMS level above which a block counts as speech
+            min_speech_seconds (float): Speech duration required to trigger a barge-in
+            sample_rate (int): Microphone sample rate
+            chunk (int): Frames read from the microphone at a time
+            playback_threshold (float): RMS level that counts as speech while the assistant
+                                        is audible (None ignores the microphone meanwhile)
+            echo_tail_seconds (float): Time after playback during which it may still be heard
+            debug_mode (bool): Enable debug logging
+        """
+        self.keys = keys
+        self.detect_speech = detect_speech
+        self.speech_threshold = speech_threshold
+        self.min_speech_seconds = min_speech_seconds
+        self.sample_rate = sample_rate
+        self.chunk = chunk
+        self.playback_threshold = playback_threshold
+        self.echo_tail_seconds = echo_tail_seconds
+        self.debug_mode = debug_mode
+        self.captured_frames = []
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"BARGE-IN DEBUG: {message}")
+
+    def watch(self, cancel_token, busy, playing=None):
+        """
+        Block while the assistant is busy and cancel it if the user barges in
+
+        Args:
+            cancel_token (CancellationToken): Token cancelled on barge-in
+            busy (callable): Returns True while work or playback is still ongoing
+            playing (callable): Returns True while the assistant's audio is playing (optional)
+
+        Returns:
+            str: "key" or "speech" if the user barged in, None otherwise
+        """
+        self.captured_frames = []
+        p = None
+        stream = None
+        if self.detect_speech:
+            try:
+                p = pyaudio.PyAudio()
+                stream = p.open(format=pyaudio.paInt16,
+                                channels=1,
+                                rate=self.sample_rate,
+                                input=True,
+                                frames_per_buffer=self.chunk)
+            except Exception as e:
+                print(f"Speech barge-in unavailable: {e}")
+                stream = None
+
+        min_speech_blocks = max(1, int(self.min_speech_seconds * self.sample_rate / self.chunk))
+        speech_frames = []
+        trigger = None
+        # Until this time the microphone may pick up the assistant's own audio
+        echo_until = 0.0
+
+        try:
+            while busy() and not cancel_token.is_cancelled():
+                if any(keyboard.is_pressed(key) for key in self.keys):
+                    trigger = "key"
+                    break
+
+                if stream is None:
+                    time.sleep(0.05)
+                    continue
+
+                data = stream.read(self.chunk, exception_on_overflow=False)
+                threshold = self.speech_threshold
+                if playing is not None and playing():
+                    echo_until = time.monotonic() + self.echo_tail_seconds
+                if time.monotonic() < echo_until:
+                    threshold = self.playback_threshold
+                if threshold is not None and frame_rms(data) >= threshold:
+                    speech_frames.append(data)
+                    if len(speech_frames) >= min_speech_blocks:
+                        trigger = "speech"
+                        self.captured_frames = speech_frames
+                        break
+                else:
+                    speech_frames = []
+        finally:
+            if stream is not None:
+                stream.stop_stream()
+                stream.close()
+            if p is not None:
+                p.terminate()
+
+        if trigger is not None:
+            self.log(f"Barge-in detected ({trigger})")
+            cancel_token.cancel()
+        return trigger
@@ -0,0 +1,216 @@
+import queue
+import threading
+import time
+from collections import deque
+
+# Rough characters-per-token ratio used before Ollama reports real counts
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in a piece of text
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Approximate token count
+    """
+    if not text:
+        return 0
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class ConversationMemory:
+    """
+    Token-budgeted history of the conversation with the LLM
+
+    Turns are stored as chat messages and sent to Ollama's chat endpoint, so
+    each request only appends the new user message to an unchanged prefix
+    that Ollama can reuse from its cache. When the history exceeds max_tokens
+    (or holds more than max_turns turns) the oldest turns are evicted in one
+    go, down to low_watermark of the limit, so the prefix changes rarely.
+    Evicted turns can be compacted into a running summary by an optional
+    summarizer, one batch at a time on a background thread.
+    """
+
+    def __init__(self, max_tokens=2048, low_watermark=0.75, max_turns=50, summarizer=None,
+                 max_summary_tokens=200, debug_mode=False):
+        """
+        Initialize the conversation memory
+
+        Args:
+            max_tokens (int): Token budget for the stored history (summary included)
+            low_watermark (float): Fraction of the budget to shrink to when evicting
+            max_turns (int): Limit on the number of stored turns
+            summarizer (callable): summarizer(summary, turns) returning a new summary
+                string that folds the evicted turns into the previous summary (optional)
+            max_summary_tokens (int): Summaries longer than this are truncated
+            debug_mode (bool): Enable debug logging
+        """
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.low_watermark = low_watermark
+        self.summarizer = summarizer
+        self.max_summary_tokens = max_summary_tokens
+        self.debug_mode = debug_mode
+
+        self._lock = threading.Lock()
+        self.turns = deque()
+        self.summary = ""
+        self.turn_count = 0
+        # Bumped by clear() so compactions of a forgotten conversation are dropped
+        self.generation = 0
+        self._compact_queue = queue.Queue()
+        self._compactor = None
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"MEMORY DEBUG: {message}")
+
+    def build_messages(self, system_prompt, user_text):
+        """
+        Build the chat messages for the next request
+
+        Args:
+            system_prompt (str): The system prompt
+            user_text (str): The new user message
+
+        Returns:
+            list: Chat messages ({"role": ..., "content": ...})
+        """
+        with self._lock:
+            system = system_prompt
+            if self.summary:
+                system += f"\n\nSummary of the earlier conversation:\n{self.summary}"
+            messages = [{"role": "system", "content": system}]
+            for turn in self.turns:
+                messages.append({"role": "user", "content": turn["user"]})
+                messages.append({"role": "assistant", "content": turn["assistant"]})
+        messages.append({"role": "user", "content": user_text})
+        return messages
+
+    def add_turn(self, user_text, assistant_text, completion_tokens=None, prompt_eval_tokens=None):
+        """
+        Record a completed turn and evict old turns if the budget is exceeded
+
+        Args:
+            user_text (str): The user's message
+            assistant_text (str): The LLM's reply
+            completion_tokens (int, optional): Reply length reported by Ollama (eval_count)
+            prompt_eval_tokens (int, optional): Prompt tokens Ollama had to evaluate
+                (prompt_eval_count); low values mean the cached prefix was reused
+
+        Returns:
+            dict: The stored turn with its token counts
+        """
+        turn = {
+            "user": user_text,
+            "assistant": assistant_text,
+            "user_tokens": estimate_tokens(user_text),
+            "assistant_tokens": completion_tokens if completion_tokens is not None
+            else estimate_tokens(assistant_text),
+            "prompt_eval_tokens": prompt_eval_tokens,
+            "created": time.time(),
+        }
+        with self._lock:
+            self.turn_count += 1
+            turn["index"] = self.turn_count
+            self.turns.append(turn)
+            evicted = self._evict()
+            generation = self.generation
+
+        self.log(f"Turn {turn['index']}: {turn['user_tokens']} user tokens, "
+                 f"{turn['assistant_tokens']} reply tokens, "
+                 f"{prompt_eval_tokens} prompt tokens evaluated, "
+                 f"{self.history_tokens()} tokens in history")
+
+        if evicted and self.summarizer is not None:
+            # Summarizing calls the LLM, so keep it off the conversation thread
+            self._start_compactor()
+            self._compact_queue.put((generation, evicted))
+        return turn
+
+    def history_tokens(self):
+        """Return the token count of the stored history, summary included"""
+        with self._lock:
+            return self._history_tokens()
+
+    def get_turn_stats(self):
+        """
+        Token counts of the stored turns
+
+        Returns:
+            list: One dict per turn with index, user_tokens, assistant_tokens
+                  and prompt_eval_tokens
+        """
+        with self._lock:
+            return [
+                {key: turn[key] for key in ("index", "user_tokens", "assistant_tokens",
+                                            "prompt_eval_tokens")}
+                for turn in self.turns
+            ]
+
+    def clear(self):
+        """Forget the whole conversation"""
+        with self._lock:
+            self.turns.clear()
+            self.summary = ""
+            self.generation += 1
+
+    def _history_tokens(self):
+        return estimate_tokens(self.summary) + sum(
+            turn["user_tokens"] + turn["assistant_tokens"] for turn in self.turns)
+
+    def _evict(self):
+        """Drop the oldest turns down to the low watermark (caller holds the lock)"""
+        over_tokens = self._history_tokens() > self.max_tokens
+        over_turns = len(self.turns) > self.max_turns
+        if not over_tokens and not over_turns:
+            return []
+        token_target = int(self.max_tokens * self.low_watermark) if over_tokens else self.max_tokens
+        turn_target = int(self.max_turns * self.low_watermark) if over_turns else self.max_turns
+        evicted = []
+        # Always keep the newest turn
+        while len(self.turns) > 1 and (self._history_tokens() > token_target
+                                       or len(self.turns) > turn_target):
+            evicted.append(self.turns.popleft())
+        self.log(f"Evicted {len(evicted)} turns")
+        return evicted
+
+    def _start_compactor(self):
+        with self._lock:
+            if self._compactor is not None:
+                return
+            self._compactor = threading.Thread(target=self._compact_loop, daemon=True)
+            self._compactor.start()
+
+    def _compact_loop(self):
+        # One compaction at a time, in eviction order, so each one builds on
+        # the summary written by the previous one
+        while True:
+            generation, evicted = self._compact_queue.get()
+            self._compact(generation, evicted)
+
+    def _compact(self, generation, evicted):
+        try:
+            with self._lock:
+                if generation != self.generation:
+                    return
+                summary = self.summary
+            summary = self.summarizer(summary, evicted) or summary
+            # Keep the summary itself bounded
+            max_chars = self.max_summary_tokens * CHARS_PER_TOKEN
+            if len(summary) > max_chars:
+                summary = summary[-max_chars:]
+            with self._lock:
+                # The conversation may have been cleared while the LLM was busy
+                if generation != self.generation:
+                    self.log("Conversation cleared, discarding summary")
+                    return
+                self.summary = summary
+            self.log(f"Summary updated ({estimate_tokens(summary)} tokens)")
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
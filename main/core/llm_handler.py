@@ -9,12 +9,29 @@ sys.path.append(str(task_dir))
 import requests
 import json
 from smart_home_control import SmartHomeControl
+from light_effects import LightFrame
+from conversation_memory import ConversationMemory
+
+# Timing of light command sequences (e.g. a rainbow spelled out as several LIGHT lines)
+SEQUENCE_HOLD = 2  # seconds each step is shown
+SEQUENCE_TRANSITION = 1  # seconds to fade into each step
+
+OLLAMA_URL = "http://localhost:11434"
+MODEL_NAME = "gemma3:12b"
 
 class LLMHandler:
-    def __init__(self, debug_mode=False):
+    def __init__(self, debug_mode=False, memory=None, summarize_history=True, home_control=None):
         self.base_dir = Path(__file__).parent
         self.debug_mode = debug_mode
-        self.home_control = SmartHomeControl("API")
+        # A stand-in SmartHomeControl can be passed in, e.g. when replaying sessions
+        self.home_control = home_control if home_control is not None else SmartHomeControl("API")
+        # Multi-turn history so follow-ups like "make it brighter" work
+        if memory is None:
+            memory = ConversationMemory(
+                summarizer=self.summarize_turns if summarize_history else None,
+                debug_mode=debug_mode
+            )
+        self.memory = memory
         self.system_prompt = """You are a smart home control assistant. You control a WiZ RGBW Tunable light and a 4K TV.
 
     IMPORTANT: When responding to control requests, ALWAYS use clear command formatting:
@@ -58,6 +75,12 @@ class LLMHandler:
     LIGHT:wiz:ON:brightness=50:color=120,100
     LIGHT:wiz:ON:brightness=50:color=240,100"
     
+    For built-in effects, add an effect parameter instead of spelling out each color:
+    - LIGHT:wiz:ON:effect=rainbow
+    - LIGHT:wiz:ON:effect=colorloop
+    - LIGHT:wiz:ON:brightness=80:effect=pulse:color=240,100
+    - LIGHT:wiz:ON:effect=fade:color=30,100
+    
     Always include a natural language response first, followed by the commands on separate lines."""
 
     def log(self, message):
@@ -65,31 +88,107 @@ class LLMHandler:
         if self.debug_mode:
             print(f"DEBUG: {message}")
 
-    def send_prompt(self, prompt, max_tokens=1024):
-        try:
-            url = "http://localhost:11434/api/generate"
-            headers = {
-                "Content-Type": "application/json"
-            }
+    def send_prompt(self, prompt, max_tokens=1024, cancel_token=None, remember=True):
+        """
+        Send a prompt to the LLM, with the conversation so far, and collect the streamed reply
+        
+        The history is sent as chat messages so each turn only appends to a
+        prefix Ollama has already processed. The reply is streamed so that a
+        cancelled request can be aborted mid-generation; closing the
+        connection stops Ollama from generating further tokens.
+        
+        Args:
+            prompt (str): The user's command
+            max_tokens (int): Maximum number of tokens to generate
+            cancel_token (CancellationToken): Aborts the generation when cancelled (optional)
+            remember (bool): Whether to add this turn to the conversation memory
             
-            formatted_prompt = f"{self.system_prompt}\n\nUser: {prompt}\nAssistant:"
+        Returns:
+            list: A single Ollama response dict, or an empty list on error or cancellation
+        """
+        try:
+            url = f"{OLLAMA_URL}/api/chat"
             
             data = {
-                "model": "gemma3:12b",
-                "prompt": formatted_prompt,
+                "model": MODEL_NAME,
+                "messages": self.memory.build_messages(self.system_prompt, prompt),
                 "max_tokens": max_tokens,
-                "system": self.system_prompt,
-                "stream": False
+                "stream": True
             }
             
-            response = requests.post(url, json=data)
-            response_json = json.loads(response.text)
+            if cancel_token is not None and cancel_token.is_cancelled():
+                return []
+            
+            response = requests.post(url, json=data, stream=True)
+            if cancel_token is not None:
+                cancel_token.add_callback(response.close)
+            
+            # Merge the streamed chunks into a single response dict
+            response_json = {}
+            pieces = []
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    pieces.append(chunk.get("message", {}).get("content", ""))
+                    response_json = chunk
+                    if chunk.get("done"):
+                        break
+            except Exception:
+                if cancel_token is None or not cancel_token.is_cancelled():
+                    raise
+            finally:
+                response.close()
+            
+            if cancel_token is not None and cancel_token.is_cancelled():
+                self.log("LLM generation cancelled")
+                return []
+            
+            response_json["response"] = "".join(pieces)
+            
+            if remember and response_json["response"]:
+                turn = self.memory.add_turn(prompt, response_json["response"],
+                                            completion_tokens=response_json.get("eval_count"),
+                                            prompt_eval_tokens=response_json.get("prompt_eval_count"))
+                response_json["turn_tokens"] = {
+                    "user": turn["user_tokens"],
+                    "assistant": turn["assistant_tokens"],
+                    "prompt_evaluated": turn["prompt_eval_tokens"],
+                    "history": self.memory.history_tokens()
+                }
             return [response_json]
 
         except Exception as e:
             print(f"Error in send_prompt: {e}")
             return []
 
+    def summarize_turns(self, summary, turns):
+        """
+        Fold turns evicted from the conversation memory into a short summary
+        
+        Args:
+            summary (str): The previous summary (may be empty)
+            turns (list): Evicted turns with "user" and "assistant" text
+            
+        Returns:
+            str: The updated summary
+        """
+        transcript = "\n".join(f"User: {turn['user']}\nAssistant: {turn['assistant']}" for turn in turns)
+        prompt = (
+            "Update the summary of a smart home conversation. Keep device states, "
+            "preferences and anything the user may refer back to. Reply with the summary only, "
+            "in at most three sentences.\n\n"
+            f"Current summary: {summary or '(none)'}\n\nNew conversation:\n{transcript}"
+        )
+        response = requests.post(f"{OLLAMA_URL}/api/generate",
+                                 json={"model": MODEL_NAME, "prompt": prompt, "stream": False})
+        return json.loads(response.text).get("response", "").strip()
+
+    def reset_conversation(self):
+        """Forget the conversation history"""
+        self.memory.clear()
+
     def analyze_llm_response(self, parsed_responses):
         try:
             response_text = "".join([item["response"] for item in parsed_responses])
@@ -127,79 +226,100 @@ class LLMHandler:
         self.log(f"Converted RGB({r*255},{g*255},{b*255}) to HSL({h},{s})")
         return h, s
 
+    def parse_light_command(self, command_text):
+        """
+        Parse a LIGHT: command line
+        
+        Args:
+            command_text (str): Command line, e.g. "LIGHT:wiz:ON:brightness=50:color=240,100"
+            
+        Returns:
+            dict: light name, state, brightness, color and effect name (None if the
+                  command is malformed)
+        """
+        # Extract the command portion (everything starting with LIGHT:)
+        if "LIGHT:" not in command_text:
+            return None
+        
+        # Clean up the command - should be cleaner now that it's on its own line
+        command_pattern = command_text.strip()
+        
+        parts = command_pattern.split(":")
+        self.log(f"Cleaned command parts: {parts}")
+        
+        light = {"name": "wiz", "state": "on", "brightness": None, "color": None, "effect": None}
+        
+        # Check if "wiz" or "rgb" is in the parts (the light names we care about)
+        if "wiz" not in parts and "rgb" not in parts:
+            # Default to wiz if no light name is found
+            return light
+        
+        # Find the light name
+        light["name"] = "wiz" if "wiz" in parts else "rgb"
+        
+        # Check if it's ON or OFF command
+        if "OFF" in parts or "off" in parts:
+            light["state"] = "off"
+            return light
+        elif "ON" not in parts and "on" not in parts:
+            # Default to turning on if neither ON nor OFF is specified
+            self.log("Neither ON nor OFF found in command, defaulting to ON")
+            return light
+        
+        # Parse brightness, color and effect
+        for part in parts:
+            if part.lower().startswith("brightness="):
+                try:
+                    brightness_str = part.split("=")[1].strip('"')
+                    light["brightness"] = int(brightness_str)
+                except (ValueError, IndexError) as e:
+                    self.log(f"Error parsing brightness: {e}")
+                    light["brightness"] = 50  # Default to 50% brightness
+            elif part.lower().startswith("color="):
+                try:
+                    color_str = part.split("=")[1].strip('"')
+                    color_values = [int(x) for x in color_str.split(",")]
+                    
+                    # Handle different color formats
+                    if len(color_values) == 2:
+                        # Already in HSL (hue, saturation) format
+                        hue, sat = color_values
+                        light["color"] = (hue, sat)
+                        self.log(f"Using HSL color: {light['color']}")
+                    elif len(color_values) == 3:
+                        # RGB format, convert to HSL
+                        r, g, b = color_values
+                        hue, sat = self.rgb_to_hsl(r, g, b)
+                        light["color"] = (hue, sat)
+                        self.log(f"Converted RGB to HSL color: {light['color']}")
+                    else:
+                        self.log(f"Unrecognized color format: {color_values}")
+                        # Default to white if format is unrecognized
+                        light["color"] = (0, 0)
+                except (ValueError, IndexError) as e:
+                    self.log(f"Error parsing color: {e}")
+                    # If we can't parse the color, default to white
+                    light["color"] = (0, 0)
+            elif part.lower().startswith("effect="):
+                light["effect"] = part.split("=", 1)[1].strip('"').lower()
+        
+        return light
+
     def execute_command(self, command):
         try:
             command_type, command_text = command
             
             if command_type == "light":
-                # Extract the command portion (everything starting with LIGHT:)
-                if "LIGHT:" not in command_text:
+                light = self.parse_light_command(command_text)
+                if light is None:
                     return "Command format incorrect"
                 
-                # Clean up the command - should be cleaner now that it's on its own line
-                command_pattern = command_text.strip()
-                
-                parts = command_pattern.split(":")
-                self.log(f"Cleaned command parts: {parts}")
-                
-                # Check if "wiz" or "rgb" is in the parts (the light names we care about)
-                if "wiz" in parts or "rgb" in parts:
-                    # Find the light name
-                    if "wiz" in parts:
-                        light_name = "wiz"
-                    else:
-                        light_name = "rgb"
-                    
-                    # Check if it's ON or OFF command
-                    if "OFF" in parts or "off" in parts:
-                        return self.home_control.control_light(light_name, "off")
-                    elif "ON" in parts or "on" in parts:
-                        brightness = None
-                        color = None
-                        
-                        # Parse brightness and color
-                        for part in parts:
-                            if part.lower().startswith("brightness="):
-                                try:
-                                    brightness_str = part.split("=")[1].strip('"')
-                                    brightness = int(brightness_str)
-                                except (ValueError, IndexError) as e:
-                                    self.log(f"Error parsing brightness: {e}")
-                                    brightness = 50  # Default to 50% brightness
-                            elif part.lower().startswith("color="):
-                                try:
-                                    color_str = part.split("=")[1].strip('"')
-                                    color_values = [int(x) for x in color_str.split(",")]
-                                    
-                                    # Handle different color formats
-                                    if len(color_values) == 2:
-                                        # Already in HSL (hue, saturation) format
-                                        hue, sat = color_values
-                                        color = (hue, sat)
-                                        self.log(f"Using HSL color: {color}")
-                                    elif len(color_values) == 3:
-                                        # RGB format, convert to HSL
-                                        r, g, b = color_values
-                                        hue, sat = self.rgb_to_hsl(r, g, b)
-                                        color = (hue, sat)
-                                        self.log(f"Converted RGB to HSL color: {color}")
-                                    else:
-                                        self.log(f"Unrecognized color format: {color_values}")
-                                        # Default to white if format is unrecognized
-                                        color = (0, 0)
-                                except (ValueError, IndexError) as e:
-                                    self.log(f"Error parsing color: {e}")
-                                    # If we can't parse the color, default to white
-                                    color = (0, 0)
-                        
-                        return self.home_control.control_light(light_name, "on", brightness, color)
-                    else:
-                        # Default to turning on if neither ON nor OFF is specified
-                        self.log("Neither ON nor OFF found in command, defaulting to ON")
-                        return self.home_control.control_light(light_name, "on")
-                else:
-                    # Default to wiz if no light name is found
-                    return self.home_control.control_light("wiz", "on")
+                if light["effect"]:
+                    return self.home_control.run_light_effect(light["name"], light["effect"],
+                                                              color=light["color"],
+                                                              brightness=light["brightness"])
+                return self.home_control.control_light(light["name"], light["state"],
+                                                       light["brightness"], light["color"])
             
             elif command_type == "tv":
                 return self.home_control.control_tv(command_text)
@@ -213,7 +333,31 @@ class LLMHandler:
             print(f"Error in execute_command: {e}")
             return f"Error executing command: {str(e)}"
 
-    def process_command_from_responses(self, responses):
+    def extract_commands(self, response_text):
+        """
+        Find the command lines in an LLM response
+        
+        Returns:
+            list: (command_type, command_text) tuples in the order they appear
+        """
+        commands = []
+        
+        # Split response by lines and look for command lines
+        lines = response_text.split('\n')
+        for line in lines:
+            line = line.strip()
+            if line.startswith("LIGHT:"):
+                commands.append(("light", line))
+            elif line.startswith("TV:"):
+                if line.startswith("TV:ON"):
+                    commands.append(("tv", "on"))
+                elif line.startswith("TV:OFF"):
+                    commands.append(("tv", "off"))
+            elif line.startswith("STATUS:"):
+                commands.append(("status", line))
+        return commands
+
+    def process_command_from_responses(self, responses, cancel_token=None):
         """Process commands from previously fetched LLM responses"""
         try:
             results = []
@@ -223,48 +367,77 @@ class LLMHandler:
                 self.log(f"Processing response: {response_text}")
                 
                 # Find all command patterns
-                commands = []
+                commands = self.extract_commands(response_text)
                 
-                # Split response by lines and look for command lines
-                lines = response_text.split('\n')
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith("LIGHT:"):
-                        commands.append(("light", line))
-                    elif line.startswith("TV:"):
-                        if line.startswith("TV:ON"):
-                            commands.append(("tv", "on"))
-                        elif line.startswith("TV:OFF"):
-                            commands.append(("tv", "off"))
-                    elif line.startswith("STATUS:"):
-                        commands.append(("status", line))
+                # Several plain commands for the same light form a sequence that
+                # is played by the effect engine instead of blocking this thread
+                sequences = {}
+                for command_type, command_text in commands:
+                    if command_type == "light":
+                        light = self.parse_light_command(command_text)
+                        if light is not None and not light["effect"]:
+                            sequences.setdefault(light["name"], []).append(light)
+                sequences = {name: steps for name, steps in sequences.items() if len(steps) > 1}
                 
-                # Process all found commands
-                for i, command in enumerate(commands):
-                    try:
-                        command_type, command_text = command
-                        
-                        # Handle different command types
-                        if command_type == "light":
-                            result = self.execute_command((command_type, command_text))
-                        elif command_type == "tv":
-                            result = self.home_control.control_tv(command_text)
-                        elif command_type == "status":
-                            result = self.execute_command((command_type, command_text))
-                        else:
-                            result = f"Unknown command type: {command_type}"
-                            
-                        results.append(result)
-                        
-                        # Add a delay between commands if there are multiple
-                        if len(commands) > 1:
-                            import time
-                            print(f"Command {i+1} of {len(commands)} completed: {result}")
-                            if i < len(commands) - 1:
-                                time.sleep(2)  # 2-second delay between commands
+                # Effects send their first frame from the effect thread, so they
+                # start after the batch below has been sent; otherwise a queued
+                # call for the same light would land on top of that frame
+                effects = {}
+                
+                # Commands are queued and sent together: calls to the same service
+                # are merged and the rest pipelined over one Home Assistant connection
+                with self.home_control.batch() as batch:
+                    # Process all found commands
+                    for command in commands:
+                        if cancel_token is not None and cancel_token.is_cancelled():
+                            self.log("Command processing cancelled")
+                            break
+                        try:
+                            command_type, command_text = command
                             
-                    except Exception as e:
-                        self.log(f"Error executing command {command}: {e}")
+                            # Handle different command types
+                            if command_type == "light":
+                                light = self.parse_light_command(command_text)
+                                if light is not None and light["name"] in sequences:
+                                    continue
+                                if light is not None and light["effect"]:
+                                    # A later effect replaces an earlier one, as it would when run
+                                    effects.pop(light["name"], None)
+                                    effects[light["name"]] = light
+                                    continue
+                                if light is not None:
+                                    # A plain command after an effect replaces the effect
+                                    effects.pop(light["name"], None)
+                                result = self.execute_command((command_type, command_text))
+                            elif command_type == "tv":
+                                result = self.home_control.control_tv(command_text)
+                            elif command_type == "status":
+                                result = self.execute_command((command_type, command_text))
+                            else:
+                                result = f"Unknown command type: {command_type}"
+                                
+                            results.append(result)
+                                
+                        except Exception as e:
+                            self.log(f"Error executing command {command}: {e}")
+                results.extend(batch.errors)
+                
+                for light in effects.values():
+                    if cancel_token is not None and cancel_token.is_cancelled():
+                        break
+                    results.append(self.home_control.run_light_effect(light["name"], light["effect"],
+                                                                      color=light["color"],
+                                                                      brightness=light["brightness"]))
+                
+                for light_name, steps in sequences.items():
+                    if cancel_token is not None and cancel_token.is_cancelled():
+                        break
+                    frames = [
+                        LightFrame(step["state"], step["brightness"], step["color"],
+                                   SEQUENCE_TRANSITION, SEQUENCE_HOLD)
+                        for step in steps
+                    ]
+                    results.append(self.home_control.run_light_effect(light_name, frames))
             
             # If no commands were found, return the natural language response
             if not results:
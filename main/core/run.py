@@ -1,94 +1,259 @@
-from speech_recognition import SpeechRecognizer
-from llm_handler import LLMHandler
-from tts_handler import TTSHandler
+from barge_in import BargeInMonitor, CancellationToken
+from artifact_store import ArtifactStore
+from session_recorder import SessionRecorder
+import workers
+import atexit
 import keyboard
+import threading
 import time
 import os
 
-def main():
-    # Initialize components
-    print("Initializing components...")
-    speech_recognizer = SpeechRecognizer()
-    llm_handler = LLMHandler(debug_mode=False)  # Disable debug output by default
-    tts_handler = TTSHandler(debug_mode=False)  # Initialize TTS handler with default parameters
-    
-    # The TTSHandler already has the default reference audio configured
-    print("System ready!")
+# Interrupt the assistant when the user starts talking. Best used with a
+# headset: through speakers the assistant can hear itself, so the microphone
+# is ignored while it is speaking unless BARGE_IN_PLAYBACK_THRESHOLD is set
+# (an RMS level clearly above how loud its own voice arrives at the mic).
+BARGE_IN_ON_SPEECH = False
+BARGE_IN_PLAYBACK_THRESHOLD = None
 
-    # Voice response flag - enable by default
-    voice_response_enabled = True
+# Recordings, transcripts and TTS audio stay in memory. Set a directory to have
+# a background thread save them there (only the newest files are kept).
+PERSIST_ARTIFACTS_DIR = None
+# Copy each transcription to the clipboard
+COPY_TRANSCRIPTION_TO_CLIPBOARD = False
+# Whisper decoding profile (see asr_profiles.py; asr_tuner.py picks one for your voice)
+ASR_PROFILE = "default"
 
-    while True:
-        print("\n=== Ready for new command ===")
-        print("Options:")
-        print("- Press and hold SPACE to record your voice command")
-        print("- Press 't' to type your command")
-        print("- Press 'v' to toggle voice response", f"(currently {'enabled' if voice_response_enabled else 'disabled'})")
-        print("- Press 'q' to quit")
-        
-        # Wait for input choice
-        while True:
-            if keyboard.is_pressed('space'):
-                transcribed_text = speech_recognizer.record_and_transcribe()
-                break
-            elif keyboard.is_pressed('t'):
-                print("\nEnter your command:")
-                transcribed_text = input("> ")
-                break
-            elif keyboard.is_pressed('v'):
-                voice_response_enabled = not voice_response_enabled
-                status = "enabled" if voice_response_enabled else "disabled"
-                print(f"\nVoice response {status}")
-                time.sleep(0.5)  # Prevent multiple toggles
-            elif keyboard.is_pressed('q'):
-                print("\nGoodbye!")
-                return
-            time.sleep(0.1)
+# Set a directory to record every interaction (audio, transcript, LLM output,
+# device calls and timings) for replay with session_replay.py
+RECORD_SESSIONS_DIR = None
 
-        print(f"\nCommand: {transcribed_text}")
-        
+# Run Whisper, the LLM client with device dispatch, and TTS in separate
+# supervised processes so transcription doesn't stall input handling or playback
+MULTIPROCESS_MODE = False
+# CPU cores each worker is pinned to in multi-process mode (None lets the OS decide)
+WORKER_CPU_AFFINITY = {
+    "asr": None,
+    "llm": None,
+    "tts": None,
+}
+
+def start_workers():
+    """Start the worker processes and return stand-ins for the three handlers"""
+    supervisor = workers.WorkerSupervisor()
+    asr_worker = supervisor.add(workers.WorkerProcess(
+        "asr", workers.create_speech_recognizer,
+        {"persist_dir": PERSIST_ARTIFACTS_DIR, "copy_to_clipboard": COPY_TRANSCRIPTION_TO_CLIPBOARD,
+         "profile": ASR_PROFILE},
+        cpu_affinity=WORKER_CPU_AFFINITY["asr"]))
+    llm_worker = supervisor.add(workers.WorkerProcess(
+        "llm", workers.create_llm_handler, {"debug_mode": False},
+        cpu_affinity=WORKER_CPU_AFFINITY["llm"]))
+    tts_worker = supervisor.add(workers.WorkerProcess(
+        "tts", workers.create_tts_handler, {"persist_dir": PERSIST_ARTIFACTS_DIR},
+        cpu_affinity=WORKER_CPU_AFFINITY["tts"]))
+    supervisor.start()
+    atexit.register(supervisor.stop)
+
+    # Audio capture stays here, next to the keyboard handling; without its
+    # model the recognizer doesn't load Whisper or PyTorch
+    from speech_recognition import SpeechRecognizer
+    local_recognizer = SpeechRecognizer(load_model=False)
+    return (workers.RemoteSpeechRecognizer(asr_worker, local_recognizer),
+            workers.RemoteLLMHandler(llm_worker),
+            workers.RemoteTTSHandler(tts_worker))
+
+def record_command(speech_recognizer, interaction, initial_frames=None, until_silence=False):
+    """Record a voice command and transcribe it"""
+    pcm = speech_recognizer.capture_audio(initial_frames=initial_frames, until_silence=until_silence)
+    interaction.set_audio(pcm)
+    with interaction.stage("asr"):
+        transcribed_text = speech_recognizer.transcribe_pcm(pcm)
+    interaction.set("transcript", transcribed_text)
+    return transcribed_text
+
+def handle_command(transcribed_text, llm_handler, tts_handler, voice_response_enabled, cancel_token,
+                   interaction):
+    """Run the LLM, the device commands and the voice reply for one command"""
+    # Device calls made on this thread belong to this command, even if it is
+    # still finishing after a barge-in has started the next one
+    with interaction.active():
         # Process with LLM
         print("\nProcessing with LLM...")
-        parsed_responses = llm_handler.send_prompt(transcribed_text)
-        
+        with interaction.stage("llm"):
+            parsed_responses = llm_handler.send_prompt(transcribed_text, cancel_token=cancel_token)
+        interaction.set("llm_output", parsed_responses)
+        if cancel_token.is_cancelled():
+            return
+
         # Extract and show only the main response content
         response_text = ""
+        turn_tokens = None
         for resp in parsed_responses:
             response_text = resp.get("response", "")
-        
+            turn_tokens = resp.get("turn_tokens")
+
         # Display a cleaner format focusing on the response
         print("\nResponse:")
         print("-" * 40)
         print(response_text)
         print("-" * 40)
+        if turn_tokens:
+            print(f"Tokens: {turn_tokens['user']} in, {turn_tokens['assistant']} out, "
+                  f"{turn_tokens['history']} in conversation memory")
 
         # Process and execute the command using the already fetched response
-        result = llm_handler.process_command_from_responses(parsed_responses)
+        interaction.set("commands", llm_handler.extract_commands(response_text))
+        with interaction.stage("dispatch"):
+            result = llm_handler.process_command_from_responses(parsed_responses, cancel_token=cancel_token)
+        interaction.set("result", result)
         print(f"Action: {result}")
-        
+
         # Generate voice response if enabled
-        if voice_response_enabled and response_text:
+        if voice_response_enabled and response_text and not cancel_token.is_cancelled():
             print("\nGenerating voice response...")
             # No need for a separate clean_for_speech call - the TTS handler will do this internally
-            audio_file = tts_handler.text_to_speech(response_text, text_lang="en", clean_commands=True)
-            
-            if audio_file:
-                print(f"Voice response played and saved to: {audio_file}")
-            else:
+            with interaction.stage("tts"):
+                artifact = tts_handler.text_to_speech(response_text, text_lang="en", clean_commands=True,
+                                                      cancel_token=cancel_token)
+
+            if artifact:
+                print("Voice response playing")
+                if artifact.path:
+                    print(f"Saving voice response to: {artifact.path}")
+            elif not cancel_token.is_cancelled():
                 print("Failed to generate voice response.")
-        
+
+def main():
+    # Initialize components
+    print("Initializing components...")
+    artifact_store = ArtifactStore(persist_dir=PERSIST_ARTIFACTS_DIR)
+    if MULTIPROCESS_MODE:
+        speech_recognizer, llm_handler, tts_handler = start_workers()
+    else:
+        # Imported here: spawned workers re-import this module, and only the
+        # process that runs everything itself needs these
+        from speech_recognition import SpeechRecognizer
+        from llm_handler import LLMHandler
+        from tts_handler import TTSHandler
+        speech_recognizer = SpeechRecognizer(artifact_store=artifact_store,
+                                             copy_to_clipboard=COPY_TRANSCRIPTION_TO_CLIPBOARD,
+                                             profile=ASR_PROFILE)
+        llm_handler = LLMHandler(debug_mode=False)  # Disable debug output by default
+        tts_handler = TTSHandler(debug_mode=False, artifact_store=artifact_store)  # Initialize TTS handler with default parameters
+    barge_in_monitor = BargeInMonitor(detect_speech=BARGE_IN_ON_SPEECH,
+                                      playback_threshold=BARGE_IN_PLAYBACK_THRESHOLD)
+    from llm_handler import MODEL_NAME
+    session_recorder = SessionRecorder(RECORD_SESSIONS_DIR, metadata={"model": MODEL_NAME})
+    if not MULTIPROCESS_MODE:
+        # In multi-process mode the device calls happen in the LLM worker and aren't recorded
+        session_recorder.attach(llm_handler.home_control)
+
+    # The TTSHandler already has the default reference audio configured
+    # Synthesize the acknowledgement clips in the background
+    tts_handler.prepare_acknowledgements()
+    print("System ready!")
+
+    # Voice response flag - enable by default
+    voice_response_enabled = True
+
+    # Command captured by a barge-in, processed without showing the menu
+    pending_text = None
+    pending_interaction = None
+
+    while True:
+        if pending_text is not None:
+            transcribed_text = pending_text
+            interaction = pending_interaction
+            pending_text = None
+        else:
+            print("\n=== Ready for new command ===")
+            print("Options:")
+            print("- Press and hold SPACE to record your voice command")
+            print("- Press 't' to type your command")
+            print("- Press 'v' to toggle voice response", f"(currently {'enabled' if voice_response_enabled else 'disabled'})")
+            print("- Press 'n' to start a new conversation")
+            print("- Press 'q' to quit")
+
+            # Wait for input choice
+            while True:
+                if keyboard.is_pressed('space'):
+                    interaction = session_recorder.start_interaction("voice")
+                    transcribed_text = record_command(speech_recognizer, interaction)
+                    break
+                elif keyboard.is_pressed('t'):
+                    print("\nEnter your command:")
+                    transcribed_text = input("> ")
+                    interaction = session_recorder.start_interaction("text")
+                    interaction.set("input_text", transcribed_text)
+                    break
+                elif keyboard.is_pressed('v'):
+                    voice_response_enabled = not voice_response_enabled
+                    status = "enabled" if voice_response_enabled else "disabled"
+                    print(f"\nVoice response {status}")
+                    time.sleep(0.5)  # Prevent multiple toggles
+                elif keyboard.is_pressed('n'):
+                    llm_handler.reset_conversation()
+                    print("\nConversation history cleared")
+                    time.sleep(0.5)
+                elif keyboard.is_pressed('q'):
+                    artifact_store.flush()
+                    session_recorder.flush()
+                    print("\nGoodbye!")
+                    return
+                time.sleep(0.1)
+
+        print(f"\nCommand: {transcribed_text}")
+
+        # Acknowledge right away to cover the LLM's response time. The clip is
+        # already playing when the barge-in monitor opens the microphone, so
+        # speech detection holds off until it has finished
+        if voice_response_enabled:
+            tts_handler.play_acknowledgement()
+
+        # Handle the command in the background so the user can barge in
+        cancel_token = CancellationToken()
+        cancel_token.add_callback(tts_handler.stop_playback)
+        worker = threading.Thread(target=handle_command,
+                                  args=(transcribed_text, llm_handler, tts_handler,
+                                        voice_response_enabled, cancel_token, interaction),
+                                  daemon=True)
+        worker.start()
+
+        print("(Hold SPACE or start speaking to interrupt)")
+        trigger = barge_in_monitor.watch(
+            cancel_token, busy=lambda: worker.is_alive() or tts_handler.is_playing(),
+            playing=tts_handler.is_playing
+        )
+
+        interaction.finish(cancelled=trigger is not None)
+
+        if trigger is not None:
+            print("\nInterrupted - listening for a new command...")
+            pending_interaction = session_recorder.start_interaction("voice")
+            if trigger == "speech":
+                pending_text = record_command(
+                    speech_recognizer, pending_interaction,
+                    initial_frames=barge_in_monitor.captured_frames, until_silence=True
+                )
+            else:
+                pending_text = record_command(speech_recognizer, pending_interaction)
+            continue
+
         # Options menu
         print("\nOptions:")
         print("- Press 'r' to enter another command")
         print("- Press 'q' to quit")
-        
+
         while True:
             if keyboard.is_pressed('r'):
                 break
             if keyboard.is_pressed('q'):
+                tts_handler.stop_playback()
+                artifact_store.flush()
+                session_recorder.flush()
                 print("\nGoodbye!")
                 return
             time.sleep(0.1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,271 @@
+import copy
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Bumped whenever the layout of the records changes
+SESSION_FORMAT_VERSION = 2
+
+
+def audio_path(session_path):
+    """Path of the raw PCM file that holds a session's audio"""
+    return os.path.splitext(session_path)[0] + ".pcm"
+
+
+def load_session(path):
+    """
+    Read a session file written by SessionRecorder
+
+    A truncated last line (e.g. after a crash) is ignored. Audio references
+    are resolved, so each interaction's "audio" holds the PCM bytes (or None).
+
+    Args:
+        path (str): Path of the .jsonl session file
+
+    Returns:
+        tuple: (header, interactions) - the session header dict (or None) and
+               the list of interaction dicts in the order they were recorded
+    """
+    header = None
+    interactions = []
+    pcm_path = audio_path(path)
+    audio_file = open(pcm_path, "rb") if os.path.exists(pcm_path) else None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping unreadable line in {path}")
+                    continue
+                if record.get("type") == "session":
+                    header = record
+                elif record.get("type") == "interaction":
+                    audio = record.get("audio")
+                    if audio is not None:
+                        if audio_file is None:
+                            print(f"Audio of interaction {record.get('index')} is missing")
+                            record["audio"] = None
+                        else:
+                            audio_file.seek(audio["offset"])
+                            record["audio"] = audio_file.read(audio["length"])
+                    interactions.append(record)
+    finally:
+        if audio_file is not None:
+            audio_file.close()
+    return header, interactions
+
+
+class Interaction:
+    """Everything recorded about one command, from input to device calls"""
+
+    def __init__(self, recorder, index, source):
+        self.recorder = recorder
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._finished = False
+        self.data = {
+            "type": "interaction",
+            "index": index,
+            "started": time.time(),
+            "source": source,
+            "audio": None,
+            "sample_rate": None,
+            "input_text": None,
+            "transcript": None,
+            "llm_output": None,
+            "commands": [],
+            "ha_calls": [],
+            "result": None,
+            "cancelled": False,
+            "timings": {},
+        }
+
+    def set_audio(self, pcm, sample_rate=16000):
+        """Record the captured command audio (16-bit mono PCM)"""
+        if self.recorder.enabled:
+            # Written to the session's .pcm file; the line only references it
+            self.data["audio"] = pcm
+            self.data["sample_rate"] = sample_rate
+
+    def set(self, key, value):
+        """Record a field such as transcript, llm_output, commands or result"""
+        with self._lock:
+            if not self._finished:
+                self.data[key] = value
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage; stored in timings as <name>_ms"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if not self._finished:
+                    self.data["timings"][f"{name}_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    @contextmanager
+    def active(self):
+        """Attribute the Home Assistant calls made on this thread to this interaction"""
+        previous = getattr(self.recorder._local, "interaction", None)
+        self.recorder._local.interaction = self
+        try:
+            yield self
+        finally:
+            self.recorder._local.interaction = previous
+
+    def add_ha_calls(self, calls, results, seconds):
+        """Record one round of Home Assistant calls (see SmartHomeControl.call_observers)"""
+        round_ = {
+            "at_ms": round((time.perf_counter() - self._started) * 1000 - seconds * 1000, 2),
+            "ms": round(seconds * 1000, 2),
+            "calls": [
+                {
+                    "domain": call.domain,
+                    "service": call.service,
+                    "entity_ids": list(call.entity_ids),
+                    "data": call.service_data,
+                    "ok": not isinstance(result, Exception),
+                }
+                for call, result in zip(calls, results)
+            ],
+        }
+        with self._lock:
+            if not self._finished:
+                self.data["ha_calls"].append(round_)
+
+    def finish(self, cancelled=False):
+        """
+        Close the interaction and append it to the session file
+
+        Anything recorded afterwards (e.g. by a command thread that is still
+        winding down after a barge-in) is ignored.
+        """
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self.data["cancelled"] = cancelled
+            self.data["timings"]["total_ms"] = round((time.perf_counter() - self._started) * 1000, 2)
+            # The writer thread serializes its own copy
+            record = copy.deepcopy(self.data)
+        self.recorder._finish(record)
+
+
+class SessionRecorder:
+    """
+    Append-only recorder of interactions for later replay
+
+    Each session is one JSON Lines file: a header line followed by one line
+    per interaction holding the typed text, the transcript, the raw LLM
+    output, the parsed commands, the Home Assistant calls and the time spent
+    in each stage. Input audio is appended as raw PCM to a .pcm file next to
+    it, and the line records its offset and length. Both files are written
+    by a background thread and flushed record by record, so a crash loses
+    at most the interaction in progress. With session_dir=None nothing is written and
+    the recorder only costs a few dict updates per command.
+    """
+
+    def __init__(self, session_dir=None, metadata=None, debug_mode=False):
+        """
+        Initialize the recorder
+
+        Args:
+            session_dir (str): Directory for session files (None disables recording)
+            metadata (dict): Extra fields for the session header, e.g. the model name
+            debug_mode (bool): Enable debug logging
+        """
+        self.enabled = session_dir is not None
+        self.metadata = metadata or {}
+        self.debug_mode = debug_mode
+        self.path = None
+        if self.enabled:
+            stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.path = os.path.join(session_dir, f"session_{stamp}.jsonl")
+
+        self._lock = threading.Lock()
+        self._count = 0
+        # The interaction each thread is working on (see Interaction.active)
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"SESSION DEBUG: {message}")
+
+    def attach(self, home_control):
+        """Record the Home Assistant calls a SmartHomeControl makes"""
+        home_control.call_observers.append(self._on_service_calls)
+
+    def start_interaction(self, source):
+        """
+        Begin recording a command
+
+        Args:
+            source (str): "voice" or "text"
+
+        Returns:
+            Interaction: Collects the data until finish() is called
+        """
+        with self._lock:
+            self._count += 1
+            return Interaction(self, self._count, source)
+
+    def flush(self):
+        """Block until every finished interaction has been written"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def _on_service_calls(self, calls, results, seconds):
+        # Calls from threads that aren't handling a command (e.g. light effect
+        # frames) are not attributed to any interaction
+        interaction = getattr(self._local, "interaction", None)
+        if interaction is not None:
+            interaction.add_ha_calls(calls, results, seconds)
+
+    def _finish(self, record):
+        if not self.enabled:
+            return
+        self._start_writer()
+        self._queue.put(record)
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is not None:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            header = {"type": "session", "version": SESSION_FORMAT_VERSION, "started": time.time(),
+                      "audio_file": os.path.basename(audio_path(self.path))}
+            header.update(self.metadata)
+            self._queue.put(header)
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def _write_loop(self):
+        with open(self.path, "a", encoding="utf-8") as f, open(audio_path(self.path), "ab") as audio_f:
+            while True:
+                record = self._queue.get()
+                try:
+                    if isinstance(record.get("audio"), bytes):
+                        # Audio first, so a line never references audio that isn't there
+                        pcm = record["audio"]
+                        record = dict(record, audio={"offset": audio_f.tell(), "length": len(pcm)})
+                        audio_f.write(pcm)
+                        audio_f.flush()
+                    f.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+                    f.flush()
+                    self.log(f"Recorded {record['type']} to {self.path}")
+                except Exception as e:
+                    print(f"Error recording session: {e}")
+                finally:
+                    self._queue.task_done()
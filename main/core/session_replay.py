@@ -0,0 +1,259 @@
+"""
+Replay recorded sessions to compare the latency of two versions of the code
+
+Usage:
+    # On the old version
+    python session_replay.py replay sessions/session_20250101_120000.jsonl --out before.json
+    # After the change
+    python session_replay.py replay sessions/session_20250101_120000.jsonl --out after.json
+    python session_replay.py compare before.json after.json
+
+Recorded audio is transcribed again by SpeechRecognizer, and the recorded
+raw LLM output is fed to LLMHandler.process_command_from_responses with a
+SmartHomeControl whose REST client is a stand-in, so that every run sees
+the same inputs. Home Assistant is never contacted; each call to the
+stand-in takes a fixed time (by default the median round-trip recorded in
+the session). The LLM itself is not re-run - its output is replayed.
+"""
+import sys
+from pathlib import Path
+import argparse
+import json
+import statistics
+import time
+from collections import namedtuple
+
+# Add the task directory to the path (for SmartHomeControl)
+task_dir = Path(__file__).parent.parent / 'task'
+sys.path.append(str(task_dir))
+
+from session_recorder import load_session
+
+# Stages timed during replay, in pipeline order
+REPLAY_STAGES = ("asr_ms", "dispatch_ms")
+
+# What ReplayClient.get_state returns, shaped like homeassistant_api's State
+ReplayState = namedtuple("ReplayState", "entity_id state attributes")
+
+
+class ReplayClient:
+    """Stand-in for the Home Assistant REST client used by SmartHomeControl"""
+
+    def __init__(self, latency=0.0):
+        """
+        Args:
+            latency (float): Seconds each request takes
+        """
+        self.latency = latency
+        self.requests = []
+
+    def request(self, method, path, json=None):
+        time.sleep(self.latency)
+        self.requests.append((method, path, json))
+        return []
+
+    def get_state(self, entity_id):
+        time.sleep(self.latency)
+        self.requests.append(("get", f"states/{entity_id}", None))
+        return ReplayState(entity_id, "on", {"brightness": 255, "hs_color": (0, 0)})
+
+
+def recorded_ha_latency(interactions):
+    """Median duration of the recorded rounds of Home Assistant calls, in seconds"""
+    samples = [round_["ms"] for interaction in interactions for round_ in interaction["ha_calls"]]
+    return statistics.median(samples) / 1000 if samples else 0.0
+
+
+def summarize(samples):
+    """Mean, median and 95th percentile of a list of milliseconds"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean": statistics.mean(ordered),
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+def replay_session(path, asr=True, ha_latency=None, repeat=1, label=None, asr_profile="default",
+                   debug_mode=False):
+    """
+    Run a recorded session through the current code
+
+    Args:
+        path (str): Session file written by SessionRecorder
+        asr (bool): Transcribe the recorded audio again (loads Whisper)
+        ha_latency (float): Seconds per Home Assistant call (None uses the recorded median)
+        repeat (int): Times to replay the whole session
+        label (str): Name of this run in the report, e.g. a git commit
+        asr_profile (str): Decoding profile used for transcription (see asr_profiles)
+        debug_mode (bool): Enable debug logging
+
+    Returns:
+        dict: Report with per-interaction timings and per-stage summaries
+    """
+    # Imported here so comparing reports needs neither Whisper nor Home Assistant
+    from smart_home_control import SmartHomeControl
+    from llm_handler import LLMHandler
+    from artifact_store import ArtifactStore
+
+    header, interactions = load_session(path)
+    if ha_latency is None:
+        ha_latency = recorded_ha_latency(interactions)
+
+    recognizer = None
+    if asr and any(interaction["audio"] for interaction in interactions):
+        from speech_recognition import SpeechRecognizer
+        recognizer = SpeechRecognizer(artifact_store=ArtifactStore(), profile=asr_profile)
+        # The first transcription is much slower than the rest; keep it out of the numbers
+        first = next(interaction for interaction in interactions if interaction["audio"])
+        recognizer.transcribe_pcm(first["audio"])
+
+    ha_rounds = []
+    rows = []
+    for run in range(repeat):
+        # Fresh shadow state for every run, so repeats send the same calls
+        client = ReplayClient(latency=ha_latency)
+        home_control = SmartHomeControl("", use_websocket=False, client=client)
+        home_control.call_observers.append(lambda calls, results, seconds: ha_rounds.append(len(calls)))
+        llm_handler = LLMHandler(debug_mode=debug_mode, summarize_history=False,
+                                 home_control=home_control)
+
+        for interaction in interactions:
+            timings = {}
+            row = {
+                "index": interaction["index"],
+                "run": run,
+                "recorded_timings": interaction["timings"],
+                "transcript_changed": False,
+                "result_changed": False,
+            }
+
+            if recognizer is not None and interaction["audio"]:
+                started = time.perf_counter()
+                transcript = recognizer.transcribe_pcm(interaction["audio"])
+                timings["asr_ms"] = (time.perf_counter() - started) * 1000
+                row["transcript_changed"] = transcript.strip() != (interaction["transcript"] or "").strip()
+
+            if interaction["llm_output"]:
+                del ha_rounds[:]
+                requests_before = len(client.requests)
+                started = time.perf_counter()
+                result = llm_handler.process_command_from_responses(interaction["llm_output"])
+                timings["dispatch_ms"] = (time.perf_counter() - started) * 1000
+                row["ha_rounds"] = len(ha_rounds)
+                row["ha_requests"] = len(client.requests) - requests_before
+                row["result_changed"] = result != interaction["result"]
+                # Light effects keep running in the background; don't let them
+                # overlap the next interaction
+                home_control.effects.cancel_all()
+
+            row["timings"] = timings
+            rows.append(row)
+            if debug_mode:
+                print(f"Interaction {interaction['index']}: {timings}")
+
+    stages = {}
+    for stage in REPLAY_STAGES:
+        stages[stage] = {
+            "replayed": summarize([row["timings"][stage] for row in rows if stage in row["timings"]]),
+            "recorded": summarize([interaction["timings"][stage] for interaction in interactions
+                                   if stage in interaction["timings"]]),
+        }
+
+    return {
+        "label": label,
+        "session": path,
+        "session_header": header,
+        "ha_latency_ms": ha_latency * 1000,
+        "repeat": repeat,
+        "asr_profile": asr_profile,
+        "interactions": rows,
+        "stages": stages,
+    }
+
+
+def compare_reports(before, after):
+    """
+    Print the per-stage latency difference between two replay reports
+
+    Args:
+        before (dict): Report of the baseline version
+        after (dict): Report of the changed version
+    """
+    if before["session"] != after["session"]:
+        print(f"Warning: reports come from different sessions "
+              f"({before['session']} vs {after['session']})")
+    if before["ha_latency_ms"] != after["ha_latency_ms"]:
+        print(f"Warning: simulated HA latency differs "
+              f"({before['ha_latency_ms']:.1f} ms vs {after['ha_latency_ms']:.1f} ms)")
+
+    name_before = before.get("label") or "before"
+    name_after = after.get("label") or "after"
+    print(f"\n{'stage':<12}{'metric':<8}{name_before:>14}{name_after:>14}{'delta':>12}{'change':>9}")
+    print("-" * 69)
+    for stage in REPLAY_STAGES:
+        old = before["stages"].get(stage, {}).get("replayed")
+        new = after["stages"].get(stage, {}).get("replayed")
+        if not old or not new:
+            continue
+        for metric in ("median", "p95"):
+            delta = new[metric] - old[metric]
+            change = f"{delta / old[metric] * 100:+.1f}%" if old[metric] else "-"
+            print(f"{stage[:-3]:<12}{metric:<8}{old[metric]:>11.1f} ms{new[metric]:>11.1f} ms"
+                  f"{delta:>+9.1f} ms{change:>9}")
+
+    # Behaviour changes make the latency comparison less meaningful
+    for name, report in ((name_before, before), (name_after, after)):
+        changed = sorted({row["index"] for row in report["interactions"] if row["result_changed"]})
+        if changed:
+            print(f"{name}: device results differ from the recording for interactions {changed}")
+        changed = sorted({row["index"] for row in report["interactions"] if row["transcript_changed"]})
+        if changed:
+            print(f"{name}: transcripts differ from the recording for interactions {changed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sessions and compare latency")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = subparsers.add_parser("replay", help="Replay a session and write a report")
+    replay_parser.add_argument("session", help="Session file (.jsonl)")
+    replay_parser.add_argument("--out", required=True, help="Report file to write (.json)")
+    replay_parser.add_argument("--label", help="Name of this run, e.g. a git commit")
+    replay_parser.add_argument("--no-asr", action="store_true", help="Skip transcription")
+    replay_parser.add_argument("--ha-latency-ms", type=float,
+                               help="Simulated Home Assistant latency (default: recorded median)")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="Times to replay the session")
+    replay_parser.add_argument("--asr-profile", default="default", help="ASR decoding profile")
+    replay_parser.add_argument("--debug", action="store_true", help="Enable debug output")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two replay reports")
+    compare_parser.add_argument("before", help="Report of the baseline version")
+    compare_parser.add_argument("after", help="Report of the changed version")
+
+    args = parser.parse_args()
+    if args.command == "replay":
+        ha_latency = args.ha_latency_ms / 1000 if args.ha_latency_ms is not None else None
+        report = replay_session(args.session, asr=not args.no_asr, ha_latency=ha_latency,
+                                repeat=args.repeat, label=args.label, asr_profile=args.asr_profile,
+                                debug_mode=args.debug)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        for stage, summary in report["stages"].items():
+            if summary["replayed"]:
+                print(f"{stage[:-3]}: median {summary['replayed']['median']:.1f} ms, "
+                      f"p95 {summary['replayed']['p95']:.1f} ms")
+        print(f"Report saved to {args.out}")
+    else:
+        with open(args.before, encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.after, encoding="utf-8") as f:
+            after = json.load(f)
+        compare_reports(before, after)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,32 @@
-import whisper
-import torch
+import numpy as np
 import pyaudio
-import wave
 import keyboard
 import pyperclip
 from datetime import datetime
+from barge_in import frame_rms
+from artifact_store import ArtifactStore, pcm_to_wav
+from asr_profiles import get_profile, transcribe_options
 
 class SpeechRecognizer:
-    def __init__(self):
-        self.model = whisper.load_model("small")
+    def __init__(self, artifact_store=None, copy_to_clipboard=False, load_model=True, profile="default"):
+        # Decoding settings (model size, beam, fallback, threads, prompt); see asr_profiles
+        self.profile = get_profile(profile)
+        # Without the model the recognizer can only capture audio (used when
+        # transcription runs in a separate worker process); Whisper and PyTorch
+        # are then not even imported
+        self.model = None
+        if load_model:
+            import torch
+            import whisper
+            if self.profile.threads:
+                torch.set_num_threads(self.profile.threads)
+            self.model = whisper.load_model(self.profile.model)
+        # Recordings and transcripts are kept in memory; the store decides what reaches the disk
+        self.artifact_store = artifact_store if artifact_store is not None else ArtifactStore()
+        self.copy_to_clipboard = copy_to_clipboard
         
-    def record_audio(self, filename="temp_recording.wav", sample_rate=16000):
+    def capture_audio(self, sample_rate=16000, initial_frames=None, until_silence=False,
+                      silence_threshold=500, silence_seconds=0.8, max_seconds=15):
         # Audio recording parameters
         CHUNK = 1024
         FORMAT = pyaudio.paInt16
@@ -23,15 +39,31 @@ class SpeechRecognizer:
                        input=True,
                        frames_per_buffer=CHUNK)
         
-        print("Press and hold SPACE to record, release to stop...")
-        frames = []
+        # Audio already captured (e.g. by the barge-in monitor) is kept
+        frames = list(initial_frames or [])
         
-        keyboard.wait('space')
-        print("Recording... (Release SPACE to stop)")
-        
-        while keyboard.is_pressed('space'):
-            data = stream.read(CHUNK)
-            frames.append(data)
+        if until_silence:
+            # Voice-activated capture: stop after a stretch of silence
+            print("Recording... (stop speaking to finish)")
+            silent_chunks = 0
+            max_silent_chunks = int(silence_seconds * sample_rate / CHUNK)
+            max_chunks = int(max_seconds * sample_rate / CHUNK)
+            while len(frames) < max_chunks and silent_chunks < max_silent_chunks:
+                data = stream.read(CHUNK, exception_on_overflow=False)
+                frames.append(data)
+                if frame_rms(data) < silence_threshold:
+                    silent_chunks += 1
+                else:
+                    silent_chunks = 0
+        else:
+            print("Press and hold SPACE to record, release to stop...")
+            
+            keyboard.wait('space')
+            print("Recording... (Release SPACE to stop)")
+            
+            while keyboard.is_pressed('space'):
+                data = stream.read(CHUNK)
+                frames.append(data)
         
         print("Recording stopped!")
         
@@ -39,25 +71,33 @@ class SpeechRecognizer:
         stream.close()
         p.terminate()
         
-        wf = wave.open(filename, 'wb')
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(p.get_sample_size(FORMAT))
-        wf.setframerate(sample_rate)
-        wf.writeframes(b''.join(frames))
-        wf.close()
-        
+        # 16-bit mono PCM
+        return b''.join(frames)
+
+    def record_audio(self, filename="temp_recording.wav", sample_rate=16000, **kwargs):
+        pcm = self.capture_audio(sample_rate=sample_rate, **kwargs)
+        with open(filename, "wb") as f:
+            f.write(pcm_to_wav(pcm, sample_rate))
         return filename
 
-    def record_and_transcribe(self):
-        temp_file = self.record_audio()
-        result = self.model.transcribe(temp_file, language="en")
+    def record_and_transcribe(self, initial_frames=None, until_silence=False):
+        pcm = self.capture_audio(initial_frames=initial_frames, until_silence=until_silence)
+        return self.transcribe_pcm(pcm)
+
+    def transcribe_pcm(self, pcm):
+        self.artifact_store.put("recording", pcm_to_wav(pcm))
+        
+        # Whisper takes 16 kHz float32 samples directly, so no temp WAV (or ffmpeg) is needed
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        use_fp16 = next(self.model.parameters()).is_cuda
+        result = self.model.transcribe(audio, **transcribe_options(self.profile, use_fp16))
         transcribed_text = result['text']
         
-        # Save to file and clipboard
-        with open("latest_transcription.txt", "w", encoding='utf-8') as f:
-            f.write(transcribed_text)
-        pyperclip.copy(transcribed_text)
+        self.artifact_store.put("transcription", transcribed_text)
         
-        print("Text has been copied to clipboard and saved to latest_transcription.txt!")
+        # Clipboard copy is opt-in
+        if self.copy_to_clipboard:
+            pyperclip.copy(transcribed_text)
+            print("Text has been copied to clipboard!")
         return transcribed_text 
 
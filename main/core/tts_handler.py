@@ -1,18 +1,29 @@
-import requests
 import json
 import os
-import time
-import pygame
 import re
-import glob
-from io import BytesIO
-import urllib.parse
+import random
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from audio_player import AudioPlayer, WavStreamParser
+from artifact_store import ArtifactStore, pcm_to_wav
+from tts_pool import TTSEndpointPool
 
 # Hard-coded reference audio configuration
 DEFAULT_REF_AUDIO = "C:\\Users\\Yau\\Documents\\YauProject\\GPT-SoVITS-v3lora-20250228\\test\\A1 (Neutral).wav"
 DEFAULT_PROMPT_TEXT = "But I commissioned it long before, like... I commissioned it a long time before we released it. So like, I was right in the middle of my voice lessons."
 DEFAULT_PROMPT_LANG = "en"
 DEFAULT_API_URL = "http://127.0.0.212:9880"
+# Size of the pieces read from a (chunked) TTS response
+STREAM_CHUNK_SIZE = 4096
+# Short phrases played right after a command is captured, while the LLM is working
+ACKNOWLEDGEMENT_PHRASES = [
+    "Okay.",
+    "Sure.",
+    "On it.",
+    "Got it.",
+    "One moment.",
+    "Let me see.",
+]
 
 class TTSHandler:
     """
@@ -22,54 +33,52 @@ class TTSHandler:
     It sends text to the API, receives audio data, and plays it locally.
     """
     
-    def __init__(self, api_url=DEFAULT_API_URL, debug_mode=False):
+    def __init__(self, api_url=DEFAULT_API_URL, debug_mode=False, artifact_store=None, api_urls=None):
         """
         Initialize the TTS Handler
         
         Args:
             api_url (str): URL of the GPT-SoVITS API
             debug_mode (bool): Enable debug logging
+            artifact_store (ArtifactStore): Where synthesized audio is kept (optional; by
+                default audio stays in memory and is only written to temp/ in debug mode)
+            api_urls (list): URLs of several GPT-SoVITS servers to balance requests over
+                (optional; overrides api_url)
         """
-        self.api_url = api_url
+        # Requests are routed through a pool, even with a single server, so that
+        # failures are tracked and latency stats are available
+        self.pool = TTSEndpointPool(api_urls or [api_url], debug_mode=debug_mode)
+        if len(self.pool.endpoints) > 1:
+            self.pool.start_health_checks()
+        self.api_url = self.pool.endpoints[0].url
         self.debug_mode = debug_mode
         self.audio_dir = os.path.join(os.path.dirname(__file__), "temp")
-        self.latest_output_file = os.path.join(self.audio_dir, "latest_tts_output.wav")
+        
+        # Synthesized audio is kept in memory; a background writer persists it if configured
+        if artifact_store is None:
+            artifact_store = ArtifactStore(persist_dir=self.audio_dir if debug_mode else None,
+                                           debug_mode=debug_mode)
+        self.artifact_store = artifact_store
         
         # Default reference audio configuration - use the hard-coded values
         self.default_ref_audio = DEFAULT_REF_AUDIO
         self.default_prompt_text = DEFAULT_PROMPT_TEXT
         self.default_prompt_lang = DEFAULT_PROMPT_LANG
         
-        # Create the audio directory if it doesn't exist
-        if not os.path.exists(self.audio_dir):
-            os.makedirs(self.audio_dir)
-        
-        # Clean up old TTS output files
-        self._cleanup_old_tts_files()
+        # Non-blocking audio output; playback runs on its own thread
+        self.player = AudioPlayer(debug_mode=debug_mode)
+        self.current_playback = None
         
-        # Initialize pygame for audio playback
-        pygame.mixer.init()
+        # Pre-synthesized acknowledgement clips, built by prepare_acknowledgements()
+        self.ack_clips = []
+        self._ack_lock = threading.Lock()
+        self._ack_generation = 0
+        self._ack_enabled = False
+        self._last_ack = None
         
-        print(f"TTS Handler initialized with API URL: {api_url}")
+        print(f"TTS Handler initialized with API URL: {', '.join(e.url for e in self.pool.endpoints)}")
         print(f"Using reference audio: {self.default_ref_audio}")
     
-    def _cleanup_old_tts_files(self):
-        """Clean up old TTS output files from previous runs"""
-        try:
-            # Find all tts_output_*.wav files
-            old_files = glob.glob(os.path.join(self.audio_dir, "tts_output_*.wav"))
-            
-            # Delete them
-            for file in old_files:
-                try:
-                    os.remove(file)
-                    if self.debug_mode:
-                        self.log(f"Deleted old TTS file: {file}")
-                except Exception as e:
-                    self.log(f"Could not delete file {file}: {e}")
-        except Exception as e:
-            self.log(f"Error cleaning up old TTS files: {e}")
-    
     def log(self, message):
         """Print debug messages only if debug mode is enabled"""
         if self.debug_mode:
@@ -88,6 +97,126 @@ class TTSHandler:
         self.default_prompt_text = prompt_text
         self.default_prompt_lang = prompt_lang
         self.log(f"Default reference set: {ref_audio_path}, '{prompt_text}' ({prompt_lang})")
+        
+        # Acknowledgement clips were made with the old voice
+        if self._ack_enabled:
+            self.prepare_acknowledgements()
+    
+    def prepare_acknowledgements(self, phrases=None, text_lang="en", background=True):
+        """
+        Pre-synthesize the acknowledgement clips with the default reference voice
+        
+        The previous bank is dropped immediately; clips of a build that was
+        superseded (e.g. by another voice change) are discarded.
+        
+        Args:
+            phrases (list): Phrases to synthesize (defaults to ACKNOWLEDGEMENT_PHRASES)
+            text_lang (str): Language of the phrases
+            background (bool): Build the bank on a background thread
+        """
+        phrases = list(phrases or ACKNOWLEDGEMENT_PHRASES)
+        with self._ack_lock:
+            self._ack_enabled = True
+            self._ack_generation += 1
+            generation = self._ack_generation
+            self.ack_clips = []
+        
+        def build():
+            clips = []
+            for phrase in phrases:
+                audio_data = self.synthesize(phrase, text_lang=text_lang)
+                if audio_data is None:
+                    continue
+                clips.append(audio_data)
+                with self._ack_lock:
+                    if generation != self._ack_generation:
+                        self.log("Acknowledgement bank superseded, discarding")
+                        return
+                    self.ack_clips = list(clips)
+            self.log(f"Prepared {len(clips)} acknowledgement clips")
+        
+        if background:
+            threading.Thread(target=build, daemon=True).start()
+        else:
+            build()
+    
+    def play_acknowledgement(self):
+        """
+        Play a random pre-synthesized acknowledgement clip without blocking
+        
+        Returns:
+            Playback: Handle of the playback, or None if no clip is ready yet
+        """
+        with self._ack_lock:
+            clips = self.ack_clips
+        if not clips:
+            return None
+        # Avoid saying the same thing twice in a row
+        choices = [clip for clip in clips if clip is not self._last_ack] or clips
+        clip = random.choice(choices)
+        self._last_ack = clip
+        return self.play_audio_data(clip)
+    
+    def build_request_params(self, text, ref_audio_path=None, prompt_text=None, prompt_lang=None,
+                             text_lang="en"):
+        """
+        Build the GPT-SoVITS query parameters, filling in the default reference
+        
+        Args:
+            text (str): Text to convert to speech
+            ref_audio_path (str): Path to reference audio file (optional, uses default if None)
+            prompt_text (str): Text content of the reference audio (optional, uses default if None)
+            prompt_lang (str): Language of the reference audio (optional, uses default if None)
+            text_lang (str): Language of the input text
+            
+        Returns:
+            dict: Query parameters, or None if no reference audio is configured
+        """
+        # Use default reference if not provided
+        if ref_audio_path is None:
+            ref_audio_path = self.default_ref_audio
+        if prompt_text is None:
+            prompt_text = self.default_prompt_text
+        if prompt_lang is None:
+            prompt_lang = self.default_prompt_lang
+        
+        # Check if reference audio is available
+        if ref_audio_path is None or prompt_text is None:
+            print("ERROR: Reference audio is required for GPT-SoVITS")
+            print("Use set_default_reference() or provide ref_audio_path and prompt_text")
+            return None
+        
+        return {
+            "refer_wav_path": ref_audio_path,
+            "prompt_text": prompt_text,
+            "prompt_language": prompt_lang,
+            "text": text,
+            "text_language": text_lang,
+            "top_k": 15,
+            "top_p": 1,
+            "temperature": 1,
+            "speed": 1
+        }
+    
+    def synthesize(self, text, text_lang="en"):
+        """
+        Synthesize text with the default reference voice without playing or storing it
+        
+        Args:
+            text (str): Text to convert to speech
+            text_lang (str): Language of the text
+            
+        Returns:
+            bytes: WAV audio data, or None on failure
+        """
+        try:
+            params = self.build_request_params(text, text_lang=text_lang)
+            if params is None:
+                return None
+            return self.pool.request(params)
+        except Exception as e:
+            print(f"Error in synthesize: {e}")
+            return None
     
     def clean_for_speech(self, text):
         """
@@ -131,7 +260,8 @@ class TTSHandler:
         return text.strip()
     
     def text_to_speech(self, text, ref_audio_path=None, prompt_text=None, prompt_lang=None, 
-                       text_lang="en", play_audio=True, clean_commands=True):
+                       text_lang="en", play_audio=True, clean_commands=True, wait=False,
+                       cancel_token=None, return_audio=True):
         """
         Convert text to speech using GPT-SoVITS API
         
@@ -143,25 +273,16 @@ class TTSHandler:
             text_lang (str): Language of the input text (en, zh, etc.)
             play_audio (bool): Whether to play the audio immediately
             clean_commands (bool): Whether to remove commands from the text
+            wait (bool): Whether to block until playback has finished
+            cancel_token (CancellationToken): Aborts synthesis and playback when cancelled (optional)
+            return_audio (bool): Include the audio in the returned Artifact (False leaves
+                                 artifact.data None, e.g. when it is sent to another process)
             
         Returns:
-            str: Path to the saved audio file
+            Artifact: The synthesized audio (artifact.path is set if it is persisted),
+                      or None on failure
         """
         try:
-            # Use default reference if not provided
-            if ref_audio_path is None:
-                ref_audio_path = self.default_ref_audio
-            if prompt_text is None:
-                prompt_text = self.default_prompt_text
-            if prompt_lang is None:
-                prompt_lang = self.default_prompt_lang
-            
-            # Check if reference audio is available
-            if ref_audio_path is None or prompt_text is None:
-                print("ERROR: Reference audio is required for GPT-SoVITS")
-                print("Use set_default_reference() or provide ref_audio_path and prompt_text")
-                return None
-                
             # Clean the text if requested
             if clean_commands:
                 speech_text = self.clean_for_speech(text)
@@ -171,102 +292,232 @@ class TTSHandler:
             else:
                 speech_text = text
             
-            # Construct the URL with query parameters
-            params = {
-                "refer_wav_path": ref_audio_path,
-                "prompt_text": prompt_text,
-                "prompt_language": prompt_lang,
-                "text": speech_text,
-                "text_language": text_lang,
-                "top_k": 15,
-                "top_p": 1,
-                "temperature": 1,
-                "speed": 1
-            }
-            
-            # Construct the full URL
-            url = f"{self.api_url}/?" + urllib.parse.urlencode(params)
-            self.log(f"Sending TTS request to: {url}")
+            # With several servers, sentences are synthesized in parallel across the pool
+            if len(self.pool.endpoints) > 1:
+                sentences = self.split_sentences(speech_text)
+            else:
+                sentences = [speech_text]
             
-            # Send the GET request
-            response = requests.get(url)
+            # Construct the query parameters for each request
+            params_list = []
+            for sentence in sentences:
+                params = self.build_request_params(sentence, ref_audio_path, prompt_text,
+                                                   prompt_lang, text_lang)
+                if params is None:
+                    return None
+                params_list.append(params)
             
-            if response.status_code != 200:
-                print(f"Error from TTS API: {response.status_code} - {response.text}")
+            if cancel_token is not None and cancel_token.is_cancelled():
                 return None
             
-            # Process the audio response
-            audio_data = response.content
+            playback = self.player.open_stream() if play_audio else None
+            self.current_playback = playback
+            if cancel_token is not None and playback is not None:
+                # Silence the speaker on barge-in
+                cancel_token.add_callback(playback.stop)
             
-            # Save to both the timestamped file (for debugging) and the latest file
-            timestamp_file = os.path.join(self.audio_dir, f"tts_output_{int(time.time())}.wav")
+            try:
+                if len(params_list) > 1:
+                    audio_data = self._synthesize_sentences(params_list, playback, cancel_token)
+                else:
+                    audio_data = self._stream_synthesis(params_list[0], playback, cancel_token)
+            finally:
+                if playback is not None:
+                    playback.close()
             
-            # For debugging: save a timestamped version
-            if self.debug_mode:
-                with open(timestamp_file, "wb") as f:
-                    f.write(audio_data)
-                self.log(f"Debug copy saved to {timestamp_file}")
+            if cancel_token is not None and cancel_token.is_cancelled():
+                self.log("TTS cancelled")
+                return None
+            if audio_data is None:
+                if playback is not None:
+                    playback.stop()
+                return None
             
-            # Always save to the latest file (overwriting previous)
-            with open(self.latest_output_file, "wb") as f:
-                f.write(audio_data)
+            if playback is not None:
+                self.log(f"Playback started after {playback.start_latency} s")
             
-            self.log(f"Audio saved to {self.latest_output_file}")
+            # Keep the audio in memory; nothing is written on this thread
+            artifact = self.artifact_store.put("tts_output", audio_data)
+            if artifact.path:
+                self.log(f"Audio queued for saving to {artifact.path}")
             
-            # Play the audio if requested
-            if play_audio:
-                self.play_audio_data(audio_data)
+            if playback is not None and wait:
+                playback.wait()
             
-            # Return the path to the latest file
-            return self.latest_output_file
+            return artifact if return_audio else artifact._replace(data=None)
                 
         except Exception as e:
             print(f"Error in text_to_speech: {e}")
             return None
     
-    def play_audio_data(self, audio_data):
+    def split_sentences(self, text):
         """
-        Play audio data using pygame
+        Split text into sentences for parallel synthesis
+        
+        Very short sentences are joined to the next one so that each request
+        still has enough context for natural prosody.
         
         Args:
-            audio_data (bytes): Audio data to play
+            text (str): Text to split
+            
+        Returns:
+            list: Sentences in order
+        """
+        sentences = []
+        pending = ""
+        for sentence in re.split(r'(?<=[.!?])\s+', text.strip()):
+            pending = f"{pending} {sentence}".strip() if pending else sentence
+            if len(pending) >= 20:
+                sentences.append(pending)
+                pending = ""
+        if pending:
+            if sentences:
+                sentences[-1] = f"{sentences[-1]} {pending}"
+            else:
+                sentences.append(pending)
+        return sentences
+    
+    def get_endpoint_stats(self):
+        """
+        Get per-endpoint state and latency statistics of the TTS pool
+        
+        Returns:
+            list: One dict per GPT-SoVITS server
         """
+        return self.pool.get_stats()
+    
+    def _stream_synthesis(self, params, playback, cancel_token):
+        """Synthesize one request, streaming the audio into playback as it arrives"""
+        # The body is read in chunks so playback can start while GPT-SoVITS
+        # is still streaming the rest of the audio
+        endpoint, response, latency = self.pool.send(params, stream=True)
+        if endpoint is None:
+            print("Error from TTS API: no endpoint could handle the request")
+            return None
+        self.log(f"Sent TTS request to {endpoint.url}")
+        
+        success = False
         try:
-            # Create a BytesIO object from the audio data
-            audio_io = BytesIO(audio_data)
+            if response.status_code != 200:
+                print(f"Error from TTS API: {response.status_code} - {response.text}")
+                return None
             
-            # Load and play the audio
-            pygame.mixer.music.load(audio_io)
-            pygame.mixer.music.play()
+            if cancel_token is not None:
+                # Drop the synthesis request on barge-in
+                cancel_token.add_callback(response.close)
             
-            # Wait for the audio to finish playing
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-                
-            self.log("Finished playing audio")
+            chunks = []
+            try:
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    chunks.append(chunk)
+                    if playback is not None:
+                        playback.write(chunk)
+            except Exception:
+                if cancel_token is None or not cancel_token.is_cancelled():
+                    raise
+            success = True
+            return b"".join(chunks)
+        finally:
+            response.close()
+            self.pool.release(endpoint, success, latency)
+    
+    def _synthesize_sentences(self, params_list, playback, cancel_token):
+        """Synthesize sentences in parallel on the pool and play them in order"""
+        executor = ThreadPoolExecutor(max_workers=len(self.pool.endpoints))
+        futures = [executor.submit(self.pool.request, params) for params in params_list]
+        executor.shutdown(wait=False)
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda: [future.cancel() for future in futures])
+        
+        audio_format = None
+        pcm_parts = []
+        for index, future in enumerate(futures):
+            if cancel_token is not None and cancel_token.is_cancelled():
+                return None
+            try:
+                audio = future.result()
+            except CancelledError:
+                return None
+            if audio is None:
+                for pending in futures[index + 1:]:
+                    pending.cancel()
+                return None
+            
+            # Each response is a complete WAV; only the PCM is appended to the output
+            parser = WavStreamParser()
+            pcm = parser.feed(audio)
+            if audio_format is None:
+                audio_format = parser.format
+            pcm_parts.append(pcm)
+            if playback is not None:
+                playback.write(audio if index == 0 else pcm)
+        
+        return pcm_to_wav(b"".join(pcm_parts), audio_format["sample_rate"],
+                          audio_format["channels"], audio_format["sample_width"])
+    
+    def play_audio_data(self, audio_data, wait=False):
+        """
+        Play audio data without blocking the caller
+        
+        Args:
+            audio_data (bytes): WAV audio data to play
+            wait (bool): Whether to block until playback has finished
+            
+        Returns:
+            Playback: Handle to stop or wait for the playback (None on error)
+        """
+        try:
+            self.current_playback = self.player.play_bytes(audio_data)
+            if wait:
+                self.current_playback.wait()
+                self.log("Finished playing audio")
+            return self.current_playback
             
         except Exception as e:
             print(f"Error playing audio: {e}")
+            return None
     
-    def play_audio_file(self, audio_file):
+    def play_audio_file(self, audio_file, wait=False):
         """
-        Play an audio file using pygame
+        Play an audio file without blocking the caller
         
         Args:
             audio_file (str): Path to the audio file
+            wait (bool): Whether to block until playback has finished
+            
+        Returns:
+            Playback: Handle to stop or wait for the playback (None on error)
         """
         try:
-            pygame.mixer.music.load(audio_file)
-            pygame.mixer.music.play()
-            
-            # Wait for the audio to finish playing
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-                
-            self.log("Finished playing audio file")
+            self.current_playback = self.player.play_file(audio_file)
+            if wait:
+                self.current_playback.wait()
+                self.log("Finished playing audio file")
+            return self.current_playback
             
         except Exception as e:
             print(f"Error playing audio file: {e}")
+            return None
+    
+    def stop_playback(self):
+        """Stop any audio that is currently playing"""
+        self.player.stop()
+    
+    def wait_for_playback(self, timeout=None):
+        """
+        Block until the current playback has finished
+        
+        Args:
+            timeout (float): Maximum number of seconds to wait (None waits forever)
+            
+        Returns:
+            bool: True if nothing is playing anymore, False on timeout
+        """
+        return self.player.wait(timeout)
+    
+    def is_playing(self):
+        """Return True while audio is playing"""
+        return self.player.is_playing()
 
 # Test the TTS functionality
 def test_tts():
@@ -286,10 +537,11 @@ def test_tts():
     cleaned_text = tts.clean_for_speech(demo_text)
     print(f"Cleaned text: '{cleaned_text}'")
     
-    audio_file = tts.text_to_speech(demo_text, text_lang="en", clean_commands=True)
+    artifact = tts.text_to_speech(demo_text, text_lang="en", clean_commands=True, wait=True)
     
-    if audio_file:
-        print(f"TTS test successful! Audio saved to: {audio_file}")
+    if artifact:
+        tts.artifact_store.flush()
+        print(f"TTS test successful! Audio saved to: {artifact.path}")
     else:
         print("TTS test failed.")
 
@@ -0,0 +1,322 @@
+import threading
+import time
+import urllib.parse
+from collections import deque
+import requests
+
+
+class TTSEndpoint:
+    """State and latency statistics of one GPT-SoVITS server"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        # Seconds from sending a request until the response headers arrived
+        self.latencies = deque(maxlen=200)
+
+    def get_stats(self):
+        """
+        Summarize the endpoint's state and latency
+
+        Returns:
+            dict: url, healthy, outstanding, request/failure counts and latency in ms
+        """
+        samples = sorted(self.latencies)
+        stats = {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "mean_ms": None,
+            "p95_ms": None,
+        }
+        if samples:
+            stats["mean_ms"] = sum(samples) / len(samples) * 1000
+            stats["p95_ms"] = samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000
+        return stats
+
+
+class TTSEndpointPool:
+    """
+    Load-balanced pool of GPT-SoVITS API servers
+
+    Requests go to the healthy endpoint with the fewest outstanding requests.
+    An endpoint that fails max_failures requests in a row is ejected; a
+    background thread probes every endpoint periodically and re-admits
+    ejected ones once they answer again, as does a request that succeeds on
+    an ejected endpoint used as a last resort. Synthesis requests are idempotent,
+    so a failed request is retried on another endpoint.
+    """
+
+    def __init__(self, urls, health_interval=10, max_failures=2, max_attempts=3,
+                 probe_timeout=2, request_timeout=60, debug_mode=False):
+        """
+        Initialize the endpoint pool
+
+        Args:
+            urls (list): Base URLs of the GPT-SoVITS API servers
+            health_interval (float): Seconds between health probes (None disables probing)
+            max_failures (int): Consecutive failures before an endpoint is ejected
+            max_attempts (int): Endpoints to try for a single request
+            probe_timeout (float): Timeout of a health probe in seconds
+            request_timeout (float): Timeout for receiving a synthesis response
+            debug_mode (bool): Enable debug logging
+        """
+        if not urls:
+            raise ValueError("At least one TTS endpoint is required")
+        self.endpoints = [TTSEndpoint(url) for url in urls]
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.max_attempts = max_attempts
+        self.probe_timeout = probe_timeout
+        self.request_timeout = request_timeout
+        self.debug_mode = debug_mode
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._health_thread = None
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"TTS POOL DEBUG: {message}")
+
+    def start_health_checks(self):
+        """Start the background health probes"""
+        if self.health_interval is None or self._health_thread is not None:
+            return
+        self._stop_event.clear()
+        self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        """Stop the background health probes"""
+        self._stop_event.set()
+        self._health_thread = None
+
+    def acquire(self, exclude=()):
+        """
+        Reserve the least busy healthy endpoint
+
+        If every endpoint is ejected, the least busy ejected one is used as a
+        last resort rather than failing outright.
+
+        Args:
+            exclude (iterable): Endpoints not to use (e.g. ones that already failed)
+
+        Returns:
+            TTSEndpoint: The reserved endpoint, or None if all are excluded
+        """
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            healthy = [e for e in candidates if e.healthy] or candidates
+            # Fewest outstanding requests first, then the lowest recent latency
+            endpoint = min(healthy, key=lambda e: (e.outstanding, self._mean_latency(e)))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, success, latency=None):
+        """
+        Return an endpoint reserved with acquire() and record the outcome
+
+        Args:
+            endpoint (TTSEndpoint): The endpoint
+            success (bool): Whether the request succeeded
+            latency (float, optional): Seconds until the response arrived
+        """
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            if latency is not None and success:
+                endpoint.latencies.append(latency)
+            if success:
+                endpoint.consecutive_failures = 0
+                if not endpoint.healthy:
+                    # Answering a real request is as good as passing a probe,
+                    # and without probes (a single server) nothing else re-admits it
+                    endpoint.healthy = True
+                    print(f"TTS endpoint {endpoint.url} re-admitted")
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.healthy and endpoint.consecutive_failures >= self.max_failures:
+                endpoint.healthy = False
+                endpoint.ejections += 1
+                print(f"TTS endpoint {endpoint.url} ejected after "
+                      f"{endpoint.consecutive_failures} failures")
+
+    def send(self, params, stream=False):
+        """
+        Send a synthesis request, retrying on other endpoints on failure
+
+        The endpoint stays reserved until release() is called, so that a
+        streamed response counts as outstanding while it is being read.
+
+        Args:
+            params (dict): GPT-SoVITS query parameters
+            stream (bool): Stream the response body
+
+        Returns:
+            tuple: (endpoint, response, latency) or (None, None, None) if every attempt failed
+        """
+        tried = []
+        for _ in range(min(self.max_attempts, len(self.endpoints))):
+            endpoint = self.acquire(exclude=tried)
+            if endpoint is None:
+                break
+            tried.append(endpoint)
+
+            url = f"{endpoint.url}/?" + urllib.parse.urlencode(params)
+            started = time.perf_counter()
+            try:
+                response = requests.get(url, stream=stream, timeout=self.request_timeout)
+            except requests.RequestException as e:
+                self.log(f"Request to {endpoint.url} failed: {e}")
+                self.release(endpoint, success=False)
+                continue
+
+            latency = time.perf_counter() - started
+            if response.status_code >= 500:
+                self.log(f"{endpoint.url} returned {response.status_code}, retrying elsewhere")
+                response.close()
+                self.release(endpoint, success=False)
+                continue
+            return endpoint, response, latency
+
+        return None, None, None
+
+    def request(self, params):
+        """
+        Synthesize audio and read the whole response
+
+        Args:
+            params (dict): GPT-SoVITS query parameters
+
+        Returns:
+            bytes: Audio data, or None on failure
+        """
+        endpoint, response, latency = self.send(params)
+        if endpoint is None:
+            print("Error from TTS API: no endpoint could handle the request")
+            return None
+        success = response.status_code == 200
+        try:
+            if not success:
+                print(f"Error from TTS API: {response.status_code} - {response.text}")
+                return None
+            return response.content
+        except requests.RequestException as e:
+            success = False
+            print(f"Error reading TTS response from {endpoint.url}: {e}")
+            return None
+        finally:
+            self.release(endpoint, success, latency)
+
+    def get_stats(self):
+        """
+        Per-endpoint state and latency statistics
+
+        Returns:
+            list: One dict per endpoint (see TTSEndpoint.get_stats)
+        """
+        with self._lock:
+            return [endpoint.get_stats() for endpoint in self.endpoints]
+
+    def probe(self, endpoint):
+        """
+        Check whether an endpoint is reachable and update its health
+
+        Any HTTP response below 500 counts as alive; GPT-SoVITS answers a
+        request without parameters with a client error.
+
+        Args:
+            endpoint (TTSEndpoint): The endpoint to probe
+
+        Returns:
+            bool: True if the endpoint is healthy
+        """
+        try:
+            alive = requests.get(endpoint.url, timeout=self.probe_timeout).status_code < 500
+        except requests.RequestException:
+            alive = False
+
+        with self._lock:
+            if alive and not endpoint.healthy:
+                print(f"TTS endpoint {endpoint.url} re-admitted")
+            elif not alive and endpoint.healthy:
+                endpoint.ejections += 1
+                print(f"TTS endpoint {endpoint.url} ejected: health probe failed")
+            endpoint.healthy = alive
+            if alive:
+                endpoint.consecutive_failures = 0
+        return alive
+
+    def _health_loop(self):
+        while not self._stop_event.wait(self.health_interval):
+            for endpoint in self.endpoints:
+                self.probe(endpoint)
+
+    def _mean_latency(self, endpoint):
+        if not endpoint.latencies:
+            return 0.0
+        return sum(endpoint.latencies) / len(endpoint.latencies)
+
+
+# Test routing, retries and ejection against local fake TTS servers
+def test_pool():
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from artifact_store import pcm_to_wav
+
+    def make_server(delay=0.0, failing=False):
+        class FakeTTSHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if failing:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                time.sleep(delay)
+                audio = pcm_to_wav(b"\x00\x00" * 3200, sample_rate=32000)
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/wav")
+                self.send_header("Content-Length", str(len(audio)))
+                self.end_headers()
+                self.wfile.write(audio)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTTSHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    servers = [make_server(delay=0.05), make_server(delay=0.2), make_server(failing=True)]
+    urls = [f"http://127.0.0.1:{server.server_address[1]}" for server in servers]
+    pool = TTSEndpointPool(urls, health_interval=None, debug_mode=True)
+
+    def worker():
+        for _ in range(4):
+            pool.request({"text": "Hello there."})
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for stats in pool.get_stats():
+        print(stats)
+
+    for server in servers:
+        server.shutdown()
+
+if __name__ == "__main__":
+    test_pool()
@@ -0,0 +1,575 @@
+import itertools
+import multiprocessing as mp
+import os
+import pickle
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+
+try:
+    import psutil
+except ImportError:  # psutil is only needed for CPU affinity on Windows and macOS
+    psutil = None
+
+# Reference to audio placed in a SharedAudioChannel slot
+SharedAudio = namedtuple("SharedAudio", "slot size")
+
+# Byte strings smaller than this are simply pickled; any real capture is
+# larger (0.1 s of 16 kHz audio is 3,200 bytes), so all audio is shared
+MIN_SHARED_BYTES = 1024
+# Default slot layout of a channel: 4 x 2 MB (about a minute of 16 kHz audio per slot)
+DEFAULT_SLOTS = 4
+DEFAULT_SLOT_SIZE = 2 * 1024 * 1024
+# Seconds the main loop waits for quick playback calls (is_playing, stop_playback)
+CONTROL_CALL_TIMEOUT = 1.0
+
+
+class WorkerError(RuntimeError):
+    """Raised when a call into a worker process fails or the worker crashes"""
+
+
+class SharedAudioChannel:
+    """
+    One-way channel for audio buffers between two processes
+
+    A shared memory block is split into fixed-size slots. The sender copies
+    a buffer into a free slot and sends only the small SharedAudio reference
+    through the request queue; the receiver copies it out and frees the slot.
+    Buffers that do not fit, or arrive while every slot is busy, are
+    returned as None by put() so the caller can fall back to pickling.
+    """
+
+    def __init__(self, ctx, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.flags = ctx.Array('b', slots)
+        self._owner = True
+
+    def __getstate__(self):
+        # Only valid while spawning the worker, when the flags can be inherited
+        return {"name": self.shm.name, "slots": self.slots, "slot_size": self.slot_size,
+                "flags": self.flags}
+
+    def __setstate__(self, state):
+        self.slots = state["slots"]
+        self.slot_size = state["slot_size"]
+        self.flags = state["flags"]
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self._owner = False
+
+    def put(self, data):
+        """
+        Copy a buffer into a free slot
+
+        Args:
+            data (bytes): Buffer to transfer
+
+        Returns:
+            SharedAudio: Reference to the slot, or None if the buffer cannot be shared
+        """
+        if len(data) > self.slot_size:
+            return None
+        with self.flags.get_lock():
+            for slot in range(self.slots):
+                if self.flags[slot] == 0:
+                    self.flags[slot] = 1
+                    break
+            else:
+                return None
+        offset = slot * self.slot_size
+        self.shm.buf[offset:offset + len(data)] = data
+        return SharedAudio(slot, len(data))
+
+    def get(self, ref):
+        """
+        Copy a buffer out of its slot and free the slot
+
+        Args:
+            ref (SharedAudio): Reference returned by put()
+
+        Returns:
+            bytes: The buffer
+        """
+        offset = ref.slot * self.slot_size
+        data = bytes(self.shm.buf[offset:offset + ref.size])
+        with self.flags.get_lock():
+            self.flags[ref.slot] = 0
+        return data
+
+    def close(self):
+        """Release the shared memory (the creating process also unlinks it)"""
+        try:
+            self.shm.close()
+            if self._owner:
+                self.shm.unlink()
+        except Exception:
+            pass
+
+
+def to_transport(obj, channel):
+    """Replace large byte strings in obj with shared memory references"""
+    if isinstance(obj, (bytes, bytearray)) and len(obj) >= MIN_SHARED_BYTES:
+        ref = channel.put(obj)
+        return ref if ref is not None else obj
+    if isinstance(obj, tuple) and hasattr(obj, "_fields"):
+        return type(obj)._make(to_transport(item, channel) for item in obj)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_transport(item, channel) for item in obj)
+    if isinstance(obj, dict):
+        return {key: to_transport(value, channel) for key, value in obj.items()}
+    return obj
+
+
+def from_transport(obj, channel):
+    """Resolve shared memory references in obj back into byte strings"""
+    if isinstance(obj, SharedAudio):
+        return channel.get(obj)
+    if isinstance(obj, tuple) and hasattr(obj, "_fields"):
+        return type(obj)._make(from_transport(item, channel) for item in obj)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(from_transport(item, channel) for item in obj)
+    if isinstance(obj, dict):
+        return {key: from_transport(value, channel) for key, value in obj.items()}
+    return obj
+
+
+def set_cpu_affinity(cpus):
+    """
+    Pin the current process to the given CPU cores
+
+    Args:
+        cpus (list): Core indices
+
+    Returns:
+        bool: True if the affinity was applied
+    """
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+            return True
+        if psutil is not None:
+            psutil.Process().cpu_affinity(list(cpus))
+            return True
+    except Exception as e:
+        print(f"Could not set CPU affinity {cpus}: {e}")
+        return False
+    print("Setting CPU affinity requires psutil on this platform")
+    return False
+
+
+def available_cpus():
+    """Return the number of cores the current process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    if psutil is not None:
+        return len(psutil.Process().cpu_affinity())
+    return os.cpu_count() or 1
+
+
+# Factories run inside the worker processes; imports happen there so the
+# main process never loads Whisper or PyTorch
+def create_speech_recognizer(persist_dir=None, **kwargs):
+    import torch
+    from artifact_store import ArtifactStore
+    from speech_recognition import SpeechRecognizer
+    # Match PyTorch's thread pool to the cores this worker is pinned to
+    torch.set_num_threads(available_cpus())
+    return SpeechRecognizer(artifact_store=ArtifactStore(persist_dir=persist_dir), **kwargs)
+
+
+def create_llm_handler(**kwargs):
+    from llm_handler import LLMHandler
+    return LLMHandler(**kwargs)
+
+
+def create_tts_handler(persist_dir=None, **kwargs):
+    from artifact_store import ArtifactStore
+    from tts_handler import TTSHandler
+    return TTSHandler(artifact_store=ArtifactStore(persist_dir=persist_dir), **kwargs)
+
+
+def _worker_main(factory, factory_kwargs, request_queue, response_queue, to_worker, from_worker,
+                 cpu_affinity):
+    """Entry point of a worker process"""
+    from barge_in import CancellationToken
+
+    if cpu_affinity:
+        set_cpu_affinity(cpu_affinity)
+    handler = factory(**factory_kwargs)
+    response_queue.put((None, "ready", None))
+
+    # Tokens of the cancellable requests still running
+    tokens = {}
+
+    def run_request(request_id, method, args, kwargs, cancellable):
+        try:
+            args = from_transport(args, to_worker)
+            kwargs = from_transport(kwargs, to_worker)
+            if cancellable:
+                kwargs["cancel_token"] = tokens[request_id]
+            result = getattr(handler, method)(*args, **kwargs)
+            payload = to_transport(result, from_worker)
+            try:
+                pickle.dumps(payload)
+            except Exception:
+                # e.g. a Playback handle, which only makes sense in this process
+                payload = None
+            response_queue.put((request_id, "ok", payload))
+        except Exception as e:
+            response_queue.put((request_id, "error", f"{type(e).__name__}: {e}"))
+        finally:
+            tokens.pop(request_id, None)
+
+    while True:
+        message = request_queue.get()
+        if message is None:
+            break
+        if message[0] == "cancel":
+            # A call always arrives before its cancel, so an unknown id means
+            # the request has already finished
+            token = tokens.get(message[1])
+            if token is not None:
+                token.cancel()
+            continue
+        _, request_id, method, args, kwargs, cancellable = message
+        if cancellable:
+            tokens[request_id] = CancellationToken()
+        # Each request runs on its own thread so that e.g. stop_playback is
+        # handled while text_to_speech is still running
+        threading.Thread(target=run_request,
+                         args=(request_id, method, args, kwargs, cancellable),
+                         daemon=True).start()
+
+    # Let the artifact writer finish before the process exits
+    artifact_store = getattr(handler, "artifact_store", None)
+    if artifact_store is not None:
+        artifact_store.flush()
+
+
+class WorkerProcess:
+    """
+    A handler object (SpeechRecognizer, LLMHandler, TTSHandler) hosted in its own process
+
+    Methods are called through submit()/call(); arguments and results are
+    pickled, except for large byte strings, which travel through shared
+    memory. A WorkerSupervisor restarts the process if it dies.
+    """
+
+    def __init__(self, name, factory, factory_kwargs=None, cpu_affinity=None, max_restarts=5,
+                 restart_window=60, debug_mode=False):
+        """
+        Initialize the worker (the process is started by start())
+
+        Args:
+            name (str): Name used in log messages
+            factory (callable): Top-level function creating the handler in the worker
+            factory_kwargs (dict): Keyword arguments for the factory
+            cpu_affinity (list): CPU cores the worker is pinned to (optional)
+            max_restarts (int): Crashes tolerated within restart_window before giving up
+            restart_window (float): Seconds over which crashes are counted
+            debug_mode (bool): Enable debug logging
+        """
+        self.name = name
+        self.factory = factory
+        self.factory_kwargs = factory_kwargs or {}
+        self.cpu_affinity = cpu_affinity
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.debug_mode = debug_mode
+
+        self._ctx = mp.get_context("spawn")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._process = None
+        self._ready = threading.Event()
+        self._stopping = False
+        self._restarts = []
+        self.failed = False
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"WORKER DEBUG [{self.name}]: {message}")
+
+    def start(self):
+        """Start (or restart) the worker process"""
+        with self._lock:
+            self._ready.clear()
+            self._request_queue = self._ctx.Queue()
+            self._response_queue = self._ctx.Queue()
+            self._to_worker = SharedAudioChannel(self._ctx)
+            self._from_worker = SharedAudioChannel(self._ctx)
+            self._process = self._ctx.Process(
+                target=_worker_main,
+                args=(self.factory, self.factory_kwargs, self._request_queue, self._response_queue,
+                      self._to_worker, self._from_worker, self.cpu_affinity),
+                name=self.name,
+                daemon=True
+            )
+            self._process.start()
+            reader = threading.Thread(target=self._read_loop,
+                                      args=(self._process, self._response_queue, self._from_worker),
+                                      daemon=True)
+            reader.start()
+        self.log(f"Started process {self._process.pid}")
+
+    def wait_ready(self, timeout=None):
+        """
+        Block until the worker has created its handler
+
+        Returns:
+            bool: True if the worker is ready, False if it died or timed out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._ready.wait(0.5):
+            if not self.is_alive():
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        return True
+
+    def is_alive(self):
+        """Return True while the worker process is running"""
+        return self._process is not None and self._process.is_alive()
+
+    def is_ready(self):
+        """Return True if the worker is running and has created its handler"""
+        return self._ready.is_set() and self.is_alive()
+
+    def submit(self, method, *args, cancellable=False, **kwargs):
+        """
+        Call a handler method without waiting for the result
+
+        Args:
+            method (str): Name of the handler method
+            cancellable (bool): Pass a cancel_token to the method that cancel() can trigger
+
+        Returns:
+            Future: Resolves to the method's result; has a request_id attribute
+        """
+        if self.failed:
+            raise WorkerError(f"Worker {self.name} is not running")
+        request_id = next(self._ids)
+        future = Future()
+        future.request_id = request_id
+        with self._lock:
+            self._pending[request_id] = future
+            args = to_transport(args, self._to_worker)
+            kwargs = to_transport(kwargs, self._to_worker)
+            self._request_queue.put(("call", request_id, method, args, kwargs, cancellable))
+        return future
+
+    def call(self, method, *args, timeout=None, **kwargs):
+        """Call a handler method and wait for the result"""
+        return self.submit(method, *args, **kwargs).result(timeout)
+
+    def cancel(self, request_id):
+        """Trigger the cancel_token of a cancellable request"""
+        with self._lock:
+            if self._process is not None:
+                self._request_queue.put(("cancel", request_id))
+
+    def restart(self):
+        """Restart the worker after a crash, unless it crashed too often"""
+        now = time.monotonic()
+        self._restarts = [t for t in self._restarts if now - t < self.restart_window] + [now]
+        if len(self._restarts) > self.max_restarts:
+            self.failed = True
+            print(f"Worker {self.name} crashed {len(self._restarts)} times, giving up")
+            return False
+        print(f"Worker {self.name} crashed (exit code {self._process.exitcode}), restarting...")
+        self._fail_pending(WorkerError(f"Worker {self.name} crashed"))
+        self._close_channels()
+        self.start()
+        return True
+
+    def stop(self, timeout=5):
+        """Stop the worker process"""
+        self._stopping = True
+        with self._lock:
+            process = self._process
+            if process is not None and process.is_alive():
+                self._request_queue.put(None)
+        if process is not None:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._fail_pending(WorkerError(f"Worker {self.name} stopped"))
+        self._close_channels()
+
+    def _read_loop(self, process, response_queue, from_worker):
+        while True:
+            try:
+                request_id, status, payload = response_queue.get(timeout=0.5)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+                continue
+            except (EOFError, OSError):
+                break
+
+            if status == "ready":
+                self._ready.set()
+                self.log("Ready")
+                continue
+
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if status == "ok":
+                future.set_result(from_transport(payload, from_worker))
+            else:
+                future.set_exception(WorkerError(payload))
+
+        # After a restart the pending requests belong to the new process
+        if self._process is process:
+            self._fail_pending(WorkerError(f"Worker {self.name} exited"))
+
+    def _fail_pending(self, error):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _close_channels(self):
+        for channel in (getattr(self, "_to_worker", None), getattr(self, "_from_worker", None)):
+            if channel is not None:
+                channel.close()
+
+
+class WorkerSupervisor:
+    """Starts worker processes and restarts any that crash"""
+
+    def __init__(self, check_interval=0.5):
+        self.check_interval = check_interval
+        self.workers = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add(self, worker):
+        """Register a worker; it is started by start()"""
+        self.workers.append(worker)
+        return worker
+
+    def start(self, wait_ready=True):
+        """Start all workers and the monitoring thread"""
+        for worker in self.workers:
+            worker.start()
+        if wait_ready:
+            for worker in self.workers:
+                if not worker.wait_ready():
+                    print(f"Worker {worker.name} failed to start")
+        self._thread = threading.Thread(target=self._monitor, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop monitoring and shut down all workers"""
+        self._stop_event.set()
+        for worker in self.workers:
+            worker.stop()
+
+    def _monitor(self):
+        while not self._stop_event.wait(self.check_interval):
+            for worker in self.workers:
+                if not worker.failed and not worker._stopping and not worker.is_alive():
+                    worker.restart()
+
+
+class RemoteSpeechRecognizer:
+    """SpeechRecognizer stand-in: captures audio locally, transcribes in a worker"""
+
+    def __init__(self, worker, recognizer):
+        """
+        Args:
+            worker (WorkerProcess): Worker hosting a SpeechRecognizer with its model
+            recognizer (SpeechRecognizer): Local recognizer created with load_model=False
+        """
+        self.worker = worker
+        self.recognizer = recognizer
+
+    def capture_audio(self, **kwargs):
+        return self.recognizer.capture_audio(**kwargs)
+
+    def transcribe_pcm(self, pcm):
+        return self.worker.call("transcribe_pcm", pcm)
+
+    def record_and_transcribe(self, initial_frames=None, until_silence=False):
+        pcm = self.capture_audio(initial_frames=initial_frames, until_silence=until_silence)
+        return self.transcribe_pcm(pcm)
+
+
+class RemoteLLMHandler:
+    """LLMHandler stand-in that runs the LLM client and device dispatch in a worker"""
+
+    def __init__(self, worker):
+        self.worker = worker
+
+    def _call_cancellable(self, method, cancel_token, *args, **kwargs):
+        future = self.worker.submit(method, *args, cancellable=True, **kwargs)
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda: self.worker.cancel(future.request_id))
+        return future.result()
+
+    def send_prompt(self, prompt, max_tokens=1024, cancel_token=None, remember=True):
+        return self._call_cancellable("send_prompt", cancel_token, prompt,
+                                      max_tokens=max_tokens, remember=remember)
+
+    def process_command_from_responses(self, responses, cancel_token=None):
+        return self._call_cancellable("process_command_from_responses", cancel_token, responses)
+
+    def reset_conversation(self):
+        return self.worker.call("reset_conversation")
+
+    def extract_commands(self, response_text):
+        return self.worker.call("extract_commands", response_text)
+
+
+class RemoteTTSHandler:
+    """
+    TTSHandler stand-in that synthesizes and plays audio in a worker
+
+    The playback calls are made from the main loop (barge-in checks, the
+    acknowledgement), so they give up after CONTROL_CALL_TIMEOUT and treat
+    a crashed or restarting worker as not playing anything.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+
+    def _control_call(self, method, default=None):
+        if not self.worker.is_ready():
+            return default
+        try:
+            return self.worker.call(method, timeout=CONTROL_CALL_TIMEOUT)
+        except (WorkerError, FutureTimeoutError) as e:
+            self.worker.log(f"{method} failed: {e}")
+            return default
+
+    def text_to_speech(self, text, cancel_token=None, **kwargs):
+        # The audio is played in the worker; only the artifact's path comes back
+        future = self.worker.submit("text_to_speech", text, cancellable=True, return_audio=False,
+                                    **kwargs)
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda: self.worker.cancel(future.request_id))
+        return future.result()
+
+    def prepare_acknowledgements(self, **kwargs):
+        return self.worker.call("prepare_acknowledgements", **kwargs)
+
+    def play_acknowledgement(self):
+        # Returns once the clip has started, so is_playing() covers it from now
+        # on; the playback handle itself stays in the worker
+        self._control_call("play_acknowledgement")
+
+    def stop_playback(self):
+        self._control_call("stop_playback")
+
+    def is_playing(self):
+        return bool(self._control_call("is_playing", default=False))
@@ -0,0 +1,450 @@
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+try:
+    import websocket
+except ImportError:  # websocket-client is only needed for the WebSocket transport
+    websocket = None
+
+# A single Home Assistant service call
+#   domain:       e.g. "light"
+#   service:      e.g. "turn_on"
+#   entity_ids:   list of target entity IDs
+#   service_data: dict of service parameters (brightness, hs_color, ...)
+ServiceCall = namedtuple("ServiceCall", "domain service entity_ids service_data")
+
+
+class HomeAssistantWebSocketError(Exception):
+    """Raised when Home Assistant rejects a command sent over the WebSocket API"""
+
+
+class HomeAssistantAuthError(HomeAssistantWebSocketError):
+    """Raised when Home Assistant rejects the access token during the handshake"""
+
+
+def merge_service_calls(calls):
+    """
+    Merge calls to the same service with identical data into one call
+
+    A call is only merged into an earlier one if no call in between targets
+    the same entities, so the final state of every entity is unchanged.
+    Calls without targets are never merged and nothing is merged across them.
+
+    Args:
+        calls (list): ServiceCall objects
+
+    Returns:
+        tuple: (merged, mapping) where merged is a list of ServiceCall objects and
+               mapping[i] is the index in merged that carries calls[i]
+    """
+    merged = []
+    mapping = []
+    index_by_key = {}
+    # Index of the last merged call that targets each entity
+    last_index = {}
+    for call in calls:
+        key = (call.domain, call.service, json.dumps(call.service_data or {}, sort_keys=True))
+        index = index_by_key.get(key) if call.entity_ids else None
+        if index is not None and all(last_index.get(entity_id, -1) <= index
+                                     for entity_id in call.entity_ids):
+            target = merged[index]
+            for entity_id in call.entity_ids:
+                if entity_id not in target.entity_ids:
+                    target.entity_ids.append(entity_id)
+        else:
+            index = len(merged)
+            merged.append(ServiceCall(call.domain, call.service, list(call.entity_ids or []),
+                                      dict(call.service_data or {})))
+            if call.entity_ids:
+                index_by_key[key] = index
+            else:
+                # Could affect anything: later calls must not move in front of it
+                index_by_key.clear()
+        for entity_id in call.entity_ids or []:
+            last_index[entity_id] = index
+        mapping.append(index)
+    return merged, mapping
+
+
+class HomeAssistantWebSocket:
+    """
+    Client for the Home Assistant WebSocket API
+
+    Keeps one authenticated connection open and pipelines commands over it:
+    each command gets a message id and a Future, and a reader thread resolves
+    the Futures as results arrive, in whatever order Home Assistant sends them.
+    A lost connection is reopened on the next command; after a failed attempt
+    further attempts are spaced out with exponential backoff. Event
+    subscriptions are renewed on every new connection; callables in
+    connection_observers are called as observer(connected) whenever the
+    connection opens or is lost, since events may have been missed in between.
+    """
+
+    def __init__(self, url, token, timeout=10, connection_factory=None, retry_delay=1,
+                 max_retry_delay=60, debug_mode=False):
+        """
+        Initialize the WebSocket client (the connection is opened on first use)
+
+        Args:
+            url (str): WebSocket URL, e.g. "ws://192.168.0.171:8123/api/websocket"
+            token (str): Long-lived access token
+            timeout (float): Seconds to wait for the handshake and for results
+            connection_factory (callable): connection_factory(url, timeout) returning an
+                object with send/recv/settimeout/close; defaults to websocket-client
+            retry_delay (float): Seconds to wait after the first failed connection attempt
+            max_retry_delay (float): Upper bound of the backoff between attempts
+            debug_mode (bool): Enable debug logging
+        """
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.connection_factory = connection_factory
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.debug_mode = debug_mode
+
+        self._ws = None
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._pending = {}
+        # (event_type, callback) of every subscription, and the callback of each
+        # subscription message id on the current connection
+        self._subscriptions = []
+        self._event_handlers = {}
+        self.connection_observers = []
+        # Backoff after failed connection attempts
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"HA WS DEBUG: {message}")
+
+    def connect(self):
+        """
+        Open and authenticate the connection if it is not open yet
+
+        Raises:
+            ConnectionError: The connection could not be made, or the last attempt
+                             failed too recently to try again
+            HomeAssistantAuthError: Home Assistant rejected the access token
+        """
+        with self._lock:
+            if self._ws is not None:
+                return
+            wait = self._retry_at - time.monotonic()
+            if wait > 0:
+                raise ConnectionError(f"Not connected to {self.url}, next attempt in {wait:.1f} s")
+            factory = self.connection_factory
+            if factory is None:
+                if websocket is None:
+                    raise ConnectionError("websocket-client is not installed")
+                factory = lambda url, timeout: websocket.create_connection(url, timeout=timeout)
+
+            try:
+                ws = factory(self.url, self.timeout)
+                message = json.loads(ws.recv())
+                if message.get("type") != "auth_required":
+                    raise ConnectionError(f"Unexpected handshake message: {message}")
+                ws.send(json.dumps({"type": "auth", "access_token": self.token}))
+                message = json.loads(ws.recv())
+            except Exception as e:
+                delay = min(self.max_retry_delay, self.retry_delay * 2 ** self._failures)
+                self._failures += 1
+                self._retry_at = time.monotonic() + delay
+                print(f"Could not connect to {self.url}, retrying in {delay:g} s: {e}")
+                if isinstance(e, ConnectionError):
+                    raise
+                raise ConnectionError(f"Could not connect to {self.url}: {e}")
+
+            if message.get("type") != "auth_ok":
+                ws.close()
+                raise HomeAssistantAuthError(f"Authentication failed: {message.get('message')}")
+
+            # The reader thread blocks on recv() until the connection is closed
+            ws.settimeout(None)
+            self._ws = ws
+            self._event_handlers = {}
+            self._failures = 0
+            self._retry_at = 0.0
+            subscriptions = list(self._subscriptions)
+            self.log(f"Connected to {self.url}")
+            threading.Thread(target=self._read_loop, args=(ws,), daemon=True).start()
+
+        for event_type, callback in subscriptions:
+            self._send_subscription(event_type, callback)
+        self._notify_connection(True)
+
+    def is_connected(self):
+        """Return True while the connection is open"""
+        with self._lock:
+            return self._ws is not None
+
+    def subscribe_events(self, event_type, callback):
+        """
+        Call callback(event) for every Home Assistant event of a type
+
+        The subscription is sent now if connected, and again on every new
+        connection. Callbacks run on the reader thread and must not block.
+
+        Args:
+            event_type (str): e.g. "state_changed"
+            callback (callable): Receives the "event" dict of each event message
+        """
+        with self._lock:
+            self._subscriptions.append((event_type, callback))
+            connected = self._ws is not None
+        if connected:
+            self._send_subscription(event_type, callback)
+
+    def _send_subscription(self, event_type, callback):
+        try:
+            self.send_command({"type": "subscribe_events", "event_type": event_type},
+                              event_handler=callback)
+        except ConnectionError as e:
+            # The next connection subscribes again
+            self.log(f"Could not subscribe to {event_type}: {e}")
+
+    def close(self):
+        """Close the connection and fail any commands still waiting for a result"""
+        with self._lock:
+            ws, self._ws = self._ws, None
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        self._fail_pending(ConnectionError("Connection closed"))
+        if ws is not None:
+            self._notify_connection(False)
+
+    def send_command(self, payload, event_handler=None):
+        """
+        Send a command without waiting for its result
+
+        Args:
+            payload (dict): Command message without the "id" field
+            event_handler (callable): For subscriptions, called with each event
+                                      message sent under the command's id
+
+        Returns:
+            Future: Resolves to the "result" field, or raises HomeAssistantWebSocketError
+        """
+        self.connect()
+        future = Future()
+        with self._lock:
+            if self._ws is None:
+                raise ConnectionError("Connection closed")
+            message_id = self._next_id
+            self._next_id += 1
+            self._pending[message_id] = future
+            if event_handler is not None:
+                self._event_handlers[message_id] = event_handler
+            message = dict(payload, id=message_id)
+            try:
+                self._ws.send(json.dumps(message))
+            except Exception as e:
+                del self._pending[message_id]
+                self._event_handlers.pop(message_id, None)
+                raise ConnectionError(f"Could not send command: {e}")
+        self.log(f"Sent {message}")
+        return future
+
+    def call_service(self, domain, service, service_data=None, entity_ids=None):
+        """
+        Call a service without waiting for the result
+
+        Args:
+            domain (str): Service domain, e.g. "light"
+            service (str): Service name, e.g. "turn_on"
+            service_data (dict, optional): Service parameters
+            entity_ids (list, optional): Target entity IDs
+
+        Returns:
+            Future: Resolves when Home Assistant has executed the call
+        """
+        payload = {
+            "type": "call_service",
+            "domain": domain,
+            "service": service,
+            "service_data": service_data or {},
+        }
+        if entity_ids:
+            payload["target"] = {"entity_id": list(entity_ids)}
+        return self.send_command(payload)
+
+    def call_services(self, calls, merge=True):
+        """
+        Send several service calls pipelined over the connection
+
+        Home Assistant runs commands concurrently, so a call that targets an
+        entity an earlier call also targets is only sent once the earlier
+        one has finished; independent calls are still pipelined.
+
+        Args:
+            calls (list): ServiceCall objects
+            merge (bool): Merge calls to the same service with identical data
+
+        Returns:
+            list: One entry per call in calls; the service result, or the exception
+                  raised for that call
+        """
+        if merge:
+            merged, mapping = merge_service_calls(calls)
+        else:
+            merged, mapping = list(calls), list(range(len(calls)))
+
+        futures = []
+        # Outstanding future of the last call sent for each entity
+        entity_futures = {}
+        for call in merged:
+            if call.entity_ids:
+                waits = [entity_futures[e] for e in call.entity_ids if e in entity_futures]
+            else:
+                waits = futures
+            for earlier in waits:
+                try:
+                    earlier.result(timeout=self.timeout)
+                except Exception:
+                    # The failure is reported for the earlier call itself
+                    pass
+            try:
+                futures.append(self.call_service(call.domain, call.service,
+                                                 call.service_data, call.entity_ids))
+            except Exception as e:
+                failed = Future()
+                failed.set_exception(e)
+                futures.append(failed)
+            for entity_id in call.entity_ids:
+                entity_futures[entity_id] = futures[-1]
+
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(timeout=self.timeout))
+            except Exception as e:
+                outcomes.append(e)
+        return [outcomes[index] for index in mapping]
+
+    def _read_loop(self, ws):
+        while True:
+            try:
+                message = json.loads(ws.recv())
+            except Exception as e:
+                self.log(f"Connection lost: {e}")
+                break
+
+            future = None
+            handler = None
+            with self._lock:
+                if message.get("type") == "event":
+                    handler = self._event_handlers.get(message.get("id"))
+                elif "id" in message:
+                    future = self._pending.pop(message["id"], None)
+            if handler is not None:
+                try:
+                    handler(message.get("event") or {})
+                except Exception as e:
+                    print(f"Error in event handler: {e}")
+                continue
+            if future is None:
+                continue
+
+            if message.get("success", False):
+                future.set_result(message.get("result"))
+            else:
+                error = message.get("error") or {}
+                future.set_exception(HomeAssistantWebSocketError(
+                    f"{error.get('code', 'unknown_error')}: {error.get('message', '')}"))
+
+        with self._lock:
+            lost = self._ws is ws
+            if lost:
+                self._ws = None
+        self._fail_pending(ConnectionError("Connection lost"))
+        if lost:
+            self._notify_connection(False)
+
+    def _notify_connection(self, connected):
+        for observer in self.connection_observers:
+            try:
+                observer(connected)
+            except Exception as e:
+                print(f"Error in connection observer: {e}")
+
+    def _fail_pending(self, error):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+
+# Test the client against a local stand-in for the Home Assistant WebSocket API
+def test_websocket_calls():
+    import queue
+
+    class FakeHomeAssistantConnection:
+        """Answers the auth handshake and every call_service like Home Assistant would"""
+
+        def __init__(self, url, timeout):
+            self.received = []
+            self.outgoing = queue.Queue()
+            self.outgoing.put({"type": "auth_required"})
+
+        def send(self, data):
+            message = json.loads(data)
+            self.received.append(message)
+            if message["type"] == "auth":
+                self.outgoing.put({"type": "auth_ok"})
+            elif message.get("domain") == "light":
+                self.outgoing.put({"id": message["id"], "type": "result", "success": True,
+                                   "result": {"context": {"id": str(message["id"])}}})
+            else:
+                self.outgoing.put({"id": message["id"], "type": "result", "success": False,
+                                   "error": {"code": "not_found", "message": "Service not found"}})
+
+        def recv(self):
+            message = self.outgoing.get()
+            if message is None:
+                raise ConnectionError("closed")
+            return json.dumps(message)
+
+        def settimeout(self, timeout):
+            pass
+
+        def close(self):
+            self.outgoing.put(None)
+
+    connections = []
+
+    def factory(url, timeout):
+        connections.append(FakeHomeAssistantConnection(url, timeout))
+        return connections[-1]
+
+    client = HomeAssistantWebSocket("ws://stand-in/api/websocket", "token",
+                                    connection_factory=factory, debug_mode=True)
+    calls = [
+        ServiceCall("light", "turn_on", ["light.a"], {"brightness": 128}),
+        ServiceCall("light", "turn_on", ["light.b"], {"brightness": 128}),
+        ServiceCall("light", "turn_off", ["light.c"], {}),
+        ServiceCall("media_player", "turn_on", ["media_player.tv"], {}),
+        # Not merged with the first call: light.a must end up on, not off
+        ServiceCall("light", "turn_off", ["light.a"], {}),
+        ServiceCall("light", "turn_on", ["light.a"], {"brightness": 128}),
+    ]
+    results = client.call_services(calls)
+    sent = [m for m in connections[0].received if m["type"] == "call_service"]
+
+    print(f"Sent {len(sent)} service calls for {len(calls)} requests")
+    print(f"First call targets: {sent[0]['target']['entity_id']}")
+    for call, result in zip(calls, results):
+        print(f"{call.domain}.{call.service} {call.entity_ids}: {result}")
+    client.close()
+
+if __name__ == "__main__":
+    test_websocket_calls()
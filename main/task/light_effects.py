@@ -0,0 +1,285 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+# One step of a light effect
+#   state:      "on" or "off"
+#   brightness: 0-100 (None keeps the current brightness)
+#   color:      (hue: 0-360, saturation: 0-100) or None
+#   transition: seconds Home Assistant should take to fade into this frame
+#   duration:   seconds until the next frame is sent
+LightFrame = namedtuple("LightFrame", "state brightness color transition duration")
+
+# Colors used by the rainbow preset (hue, saturation)
+RAINBOW_COLORS = [(0, 100), (30, 100), (60, 100), (120, 100), (240, 100), (270, 100), (300, 100)]
+
+# Seconds to wait for a frame that is already being sent when an effect is cancelled
+CANCEL_TIMEOUT = 2.0
+
+
+def _lerp(a, b, t):
+    return a + (b - a) * t
+
+
+def _interpolate_color(start, end, t):
+    """Interpolate between two (hue, saturation) colors"""
+    return (round(_lerp(start[0], end[0], t)) % 360, round(_lerp(start[1], end[1], t)))
+
+
+def fade(start_color, end_color, duration, brightness=None, steps=1):
+    """
+    Fade from one color to another
+
+    With HA transitions a single frame is enough; more steps are only needed
+    for lights that ignore the transition parameter.
+
+    Args:
+        start_color (tuple): (hue, saturation) to start from
+        end_color (tuple): (hue, saturation) to end on
+        duration (float): Length of the fade in seconds
+        brightness (int, optional): 0-100
+        steps (int): Number of frames after the start frame
+
+    Returns:
+        list: LightFrame objects
+    """
+    step_time = duration / steps
+    frames = [LightFrame("on", brightness, start_color, 0, 0)]
+    for i in range(1, steps + 1):
+        color = _interpolate_color(start_color, end_color, i / steps)
+        frames.append(LightFrame("on", brightness, color, step_time, step_time))
+    return frames
+
+
+def gradient(stops, duration, brightness=None, steps=None):
+    """
+    Move through several color stops, computing all frames in one batch
+
+    Args:
+        stops (list): (hue, saturation) colors to pass through
+        duration (float): Total length in seconds
+        brightness (int, optional): 0-100
+        steps (int, optional): Total number of frames (defaults to one per stop)
+
+    Returns:
+        list: LightFrame objects
+    """
+    if len(stops) < 2:
+        raise ValueError("A gradient needs at least two color stops")
+    if steps is None:
+        steps = len(stops) - 1
+    step_time = duration / steps
+    frames = [LightFrame("on", brightness, stops[0], 0, 0)]
+    segments = len(stops) - 1
+    for i in range(1, steps + 1):
+        position = i / steps * segments
+        index = min(int(position), segments - 1)
+        color = _interpolate_color(stops[index], stops[index + 1], position - index)
+        frames.append(LightFrame("on", brightness, color, step_time, step_time))
+    return frames
+
+
+def cycle(colors, hold, transition=0, brightness=None):
+    """
+    Step through a list of colors, holding each one
+
+    Args:
+        colors (list): (hue, saturation) colors
+        hold (float): Seconds each color is shown (including the transition)
+        transition (float): Seconds to fade into each color
+        brightness (int, optional): 0-100
+
+    Returns:
+        list: LightFrame objects
+    """
+    return [LightFrame("on", brightness, color, transition, hold) for color in colors]
+
+
+def pulse(color, low=10, high=100, period=2.0):
+    """
+    One breathing pulse between two brightness levels
+
+    Args:
+        color (tuple): (hue, saturation) or None to keep the current color
+        low (int): Lowest brightness (0-100)
+        high (int): Highest brightness (0-100)
+        period (float): Seconds for one full pulse
+
+    Returns:
+        list: LightFrame objects
+    """
+    half = period / 2
+    return [
+        LightFrame("on", high, color, half, half),
+        LightFrame("on", low, color, half, half),
+    ]
+
+
+def build_effect(name, color=None, brightness=None):
+    """
+    Build one of the named effect presets
+
+    Args:
+        name (str): "rainbow", "pulse", "fade" or "colorloop"
+        color (tuple, optional): (hue, saturation) used by pulse and fade
+        brightness (int, optional): 0-100
+
+    Returns:
+        tuple: (frames, repeat) where repeat=0 loops until cancelled, or None if unknown
+    """
+    name = name.lower()
+    if name == "rainbow":
+        return cycle(RAINBOW_COLORS, hold=2, transition=1, brightness=brightness), 1
+    if name == "colorloop":
+        return gradient(RAINBOW_COLORS + [RAINBOW_COLORS[0]], duration=30, brightness=brightness), 0
+    if name == "pulse":
+        return pulse(color, low=10, high=brightness or 100), 5
+    if name == "fade":
+        return fade((0, 0), color or (240, 100), duration=5, brightness=brightness), 1
+    return None
+
+
+class LightEffectEngine:
+    """
+    Plays light effects on background timers
+
+    Each light runs at most one effect; starting a new effect (or sending a
+    plain command through SmartHomeControl) replaces the running one. A frame
+    that is already being sent is allowed to finish first, so it cannot land
+    after whatever replaced the effect. Frames
+    are scheduled against absolute deadlines so delays do not accumulate, and
+    the lateness of every frame is recorded as timing jitter.
+    """
+
+    def __init__(self, send_frame, debug_mode=False):
+        """
+        Initialize the effect engine
+
+        Args:
+            send_frame (callable): send_frame(light_name, frame) applies a LightFrame
+            debug_mode (bool): Enable debug logging
+        """
+        self.send_frame = send_frame
+        self.debug_mode = debug_mode
+        self._lock = threading.Lock()
+        self._effects = {}
+        # Lateness of recent frames in seconds
+        self.jitter_samples = deque(maxlen=1000)
+
+    def log(self, message):
+        """Print debug messages only if debug mode is enabled"""
+        if self.debug_mode:
+            print(f"EFFECT DEBUG: {message}")
+
+    def start(self, light_name, frames, repeat=1):
+        """
+        Start an effect on a light, replacing any effect already running on it
+
+        Args:
+            light_name (str): Name or alias of the light
+            frames (list): LightFrame objects
+            repeat (int): Number of times to play the frames (0 loops until cancelled)
+
+        Returns:
+            threading.Event: Set when the effect has finished or was cancelled
+        """
+        cancel_event = threading.Event()
+        done_event = threading.Event()
+        with self._lock:
+            previous = self._effects.get(light_name)
+            self._effects[light_name] = (cancel_event, done_event)
+        if previous is not None:
+            previous[0].set()
+
+        # The new effect waits for the previous one's last frame on its own
+        # thread, so the caller doesn't block
+        thread = threading.Thread(target=self._run,
+                                  args=(light_name, list(frames), repeat, cancel_event, done_event,
+                                        previous[1] if previous is not None else None),
+                                  daemon=True)
+        thread.start()
+        return done_event
+
+    def cancel(self, light_name, timeout=CANCEL_TIMEOUT):
+        """
+        Cancel the effect running on a light
+
+        Blocks until a frame that is already being sent has been sent, so a
+        command sent after this returns is not overwritten by the effect.
+
+        Args:
+            light_name (str): Name or alias of the light
+            timeout (float): Maximum seconds to wait for that frame
+
+        Returns:
+            bool: True if an effect was running
+        """
+        with self._lock:
+            effect = self._effects.pop(light_name, None)
+        if effect is None:
+            return False
+        cancel_event, done_event = effect
+        was_running = not done_event.is_set()
+        cancel_event.set()
+        if not done_event.wait(timeout):
+            print(f"Effect on {light_name} still sending a frame after {timeout} s")
+        return was_running
+
+    def cancel_all(self, timeout=CANCEL_TIMEOUT):
+        """Cancel every running effect and wait for frames being sent (see cancel)"""
+        with self._lock:
+            effects, self._effects = self._effects, {}
+        for cancel_event, _ in effects.values():
+            cancel_event.set()
+        deadline = time.monotonic() + timeout
+        for light_name, (_, done_event) in effects.items():
+            if not done_event.wait(max(0.0, deadline - time.monotonic())):
+                print(f"Effect on {light_name} still sending a frame after {timeout} s")
+
+    def is_running(self, light_name):
+        """Return True while an effect is running on the light"""
+        with self._lock:
+            effect = self._effects.get(light_name)
+        return effect is not None and not effect[1].is_set()
+
+    def get_timing_stats(self):
+        """
+        Summarize frame timing jitter
+
+        Returns:
+            dict: Frame count and mean, 95th percentile and max lateness in milliseconds
+        """
+        samples = sorted(self.jitter_samples)
+        if not samples:
+            return {"frames": 0, "mean_ms": None, "p95_ms": None, "max_ms": None}
+        return {
+            "frames": len(samples),
+            "mean_ms": sum(samples) / len(samples) * 1000,
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            "max_ms": samples[-1] * 1000,
+        }
+
+    def _run(self, light_name, frames, repeat, cancel_event, done_event, previous_done=None):
+        if previous_done is not None:
+            previous_done.wait(CANCEL_TIMEOUT)
+        deadline = time.monotonic()
+        iteration = 0
+        try:
+            while frames and (repeat == 0 or iteration < repeat):
+                for frame in frames:
+                    # Sleep until the frame is due; a cancellation wakes us up
+                    if cancel_event.wait(max(0.0, deadline - time.monotonic())):
+                        self.log(f"Effect on {light_name} cancelled")
+                        return
+                    self.jitter_samples.append(time.monotonic() - deadline)
+                    result = self.send_frame(light_name, frame)
+                    self.log(f"Frame on {light_name}: {frame} -> {result}")
+                    deadline += frame.duration
+                iteration += 1
+        except Exception as e:
+            print(f"Error running light effect on {light_name}: {e}")
+        finally:
+            done_event.set()
+            with self._lock:
+                if self._effects.get(light_name, (None,))[0] is cancel_event:
+                    del self._effects[light_name]
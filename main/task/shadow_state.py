@@ -0,0 +1,185 @@
+import threading
+import time
+
+# Services whose resulting state can be predicted from the call itself
+TRACKED_SERVICES = {
+    ("light", "turn_on"): "on",
+    ("light", "turn_off"): "off",
+    ("remote", "turn_on"): "on",
+    ("remote", "turn_off"): "off",
+}
+# Service data keys the shadow understands; any other key makes a call untrackable
+TRACKED_KEYS = {"brightness", "hs_color", "transition"}
+# Domains whose reported states are recorded
+TRACKED_DOMAINS = {domain for domain, _ in TRACKED_SERVICES}
+
+
+class ShadowStateStore:
+    """
+    Last confirmed state of each Home Assistant entity
+
+    SmartHomeControl records the state an entity is left in after every
+    successful service call, and the real state whenever Home Assistant
+    reports it (state_changed events, status reads), and asks the store
+    before sending a call whether the entity is already there. Entries older
+    than max_age are treated as unknown.
+    """
+
+    def __init__(self, max_age=60, brightness_tolerance=2, hue_tolerance=2, saturation_tolerance=2):
+        """
+        Initialize the shadow state store
+
+        Args:
+            max_age (float): Seconds after which a recorded state is considered stale
+            brightness_tolerance (int): Allowed brightness difference (0-255 scale)
+            hue_tolerance (float): Allowed hue difference in degrees
+            saturation_tolerance (float): Allowed saturation difference in percent
+        """
+        self.max_age = max_age
+        self.brightness_tolerance = brightness_tolerance
+        self.hue_tolerance = hue_tolerance
+        self.saturation_tolerance = saturation_tolerance
+        self._lock = threading.Lock()
+        self._states = {}
+        self.stats = {"sent": 0, "suppressed": 0}
+
+    def record(self, entity_id, state, brightness=None, hs_color=None):
+        """
+        Record the confirmed state of an entity
+
+        Args:
+            entity_id (str): Full entity ID, e.g. "light.wiz_rgbw_tunable_bd2b10"
+            state (str): "on" or "off"
+            brightness (int, optional): 0-255; None keeps the previously recorded value
+            hs_color (tuple, optional): (hue, saturation); None keeps the previous value
+        """
+        with self._lock:
+            previous = self._states.get(entity_id, {})
+            self._states[entity_id] = {
+                "state": state,
+                "brightness": brightness if brightness is not None else previous.get("brightness"),
+                "hs_color": tuple(hs_color) if hs_color is not None else previous.get("hs_color"),
+                "updated": time.monotonic(),
+            }
+
+    def record_reported(self, entity_id, state, attributes=None):
+        """
+        Record a state reported by Home Assistant
+
+        States other than "on" and "off" (e.g. "unavailable") make the entity unknown.
+
+        Args:
+            entity_id (str): Full entity ID
+            state (str): The reported state
+            attributes (dict, optional): The reported attributes
+        """
+        if entity_id.split(".", 1)[0] not in TRACKED_DOMAINS:
+            return
+        if state not in ("on", "off"):
+            self.invalidate(entity_id)
+            return
+        attributes = attributes or {}
+        self.record(entity_id, state, attributes.get("brightness"), attributes.get("hs_color"))
+
+    def get(self, entity_id):
+        """
+        Get the recorded state of an entity
+
+        Returns:
+            dict: state, brightness and hs_color, or None if unknown or stale
+        """
+        with self._lock:
+            entry = self._states.get(entity_id)
+        if entry is None or time.monotonic() - entry["updated"] > self.max_age:
+            return None
+        return entry
+
+    def invalidate(self, entity_id=None):
+        """
+        Forget the recorded state of one entity, or of all entities
+
+        Args:
+            entity_id (str, optional): Entity to forget; None forgets everything
+        """
+        with self._lock:
+            if entity_id is None:
+                self._states.clear()
+            else:
+                self._states.pop(entity_id, None)
+
+    def matches(self, entity_id, state, brightness=None, hs_color=None):
+        """
+        Check whether an entity is already in the target state
+
+        Args:
+            entity_id (str): Full entity ID
+            state (str): Target state, "on" or "off"
+            brightness (int, optional): Target brightness (0-255); None means any
+            hs_color (tuple, optional): Target (hue, saturation); None means any
+
+        Returns:
+            bool: True if the shadow is fresh and matches within tolerance
+        """
+        entry = self.get(entity_id)
+        if entry is None or entry["state"] != state:
+            return False
+        if state == "off":
+            return True
+
+        if brightness is not None:
+            if entry["brightness"] is None:
+                return False
+            if abs(entry["brightness"] - brightness) > self.brightness_tolerance:
+                return False
+
+        if hs_color is not None:
+            if entry["hs_color"] is None:
+                return False
+            hue_diff = abs(entry["hs_color"][0] - hs_color[0]) % 360
+            hue_diff = min(hue_diff, 360 - hue_diff)
+            # Hue is meaningless for unsaturated (white) colors
+            both_white = entry["hs_color"][1] <= self.saturation_tolerance and \
+                hs_color[1] <= self.saturation_tolerance
+            if hue_diff > self.hue_tolerance and not both_white:
+                return False
+            if abs(entry["hs_color"][1] - hs_color[1]) > self.saturation_tolerance:
+                return False
+
+        return True
+
+    def call_is_redundant(self, domain, service, entity_id, service_data):
+        """
+        Check whether a service call would leave an entity unchanged
+
+        Args:
+            domain (str): Service domain
+            service (str): Service name
+            entity_id (str): Target entity ID
+            service_data (dict): Service parameters
+
+        Returns:
+            bool: True if the call can be skipped
+        """
+        state = TRACKED_SERVICES.get((domain, service))
+        if state is None or not set(service_data) <= TRACKED_KEYS:
+            return False
+        return self.matches(entity_id, state, service_data.get("brightness"),
+                            service_data.get("hs_color"))
+
+    def record_call(self, domain, service, entity_id, service_data):
+        """
+        Update the shadow after Home Assistant accepted a service call
+
+        Calls the store cannot predict the outcome of invalidate the entity.
+
+        Args:
+            domain (str): Service domain
+            service (str): Service name
+            entity_id (str): Target entity ID
+            service_data (dict): Service parameters
+        """
+        state = TRACKED_SERVICES.get((domain, service))
+        if state is None or not set(service_data) <= TRACKED_KEYS:
+            self.invalidate(entity_id)
+            return
+        self.record(entity_id, state, service_data.get("brightness"), service_data.get("hs_color"))
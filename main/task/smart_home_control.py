@@ -1,5 +1,10 @@
 from homeassistant_api import Client
+import threading
 import time
+from contextlib import contextmanager
+from light_effects import LightEffectEngine, build_effect
+from ha_websocket import HomeAssistantWebSocket, HomeAssistantAuthError, ServiceCall, merge_service_calls
+from shadow_state import ShadowStateStore
 
 class SmartHomeControl:
     """
@@ -14,6 +19,7 @@ class SmartHomeControl:
          * state: "on" or "off"
          * brightness: percentage from 0-100, converted to 0-255 internally
          * color: tuple of (hue: 0-360, saturation: 0-100)
+         * transition: optional fade time in seconds (Home Assistant transition)
          Examples:
          - Turn on: control_light("wiz", "on")
          - Set brightness: control_light("wiz", "on", brightness=50)
@@ -33,14 +39,79 @@ class SmartHomeControl:
        - get_status()
          Returns current state of the WiZ light including:
          * state, brightness, color
+
+    4. Light Effects
+       Methods:
+       - run_light_effect(light_name, effect, repeat=None, color=None, brightness=None)
+         * effect: preset name ("rainbow", "pulse", "fade", "colorloop") or a list of
+           LightFrame objects built with light_effects.fade/cycle/pulse/gradient
+         * runs in the background; any later command for the same light replaces it
+         Examples:
+         - Rainbow: run_light_effect("wiz", "rainbow")
+         - Stop: stop_light_effect("wiz")
+
+    5. Batched Service Calls
+       Methods:
+       - batch()
+         Context manager; service calls made inside it are queued and sent together
+         when it exits. Calls to the same service with the same data are merged into
+         one call targeting a list of entity IDs, and the rest are pipelined over the
+         WebSocket connection.
+         Example:
+         - with home.batch() as batch:
+               home.control_light("wiz", "on", brightness=50)
+               home.control_tv("on")
+           print(batch.errors)
+
+    6. Shadow State
+       The last known state of each entity is kept in self.shadow and kept up to date
+       from Home Assistant's state_changed events, so changes made by hand or by
+       automations are seen. Service calls that would not change a light or the TV
+       (within a small tolerance) are skipped while the shadow is fresh (max_age
+       seconds); use force=True to always send. Without the event stream (REST only,
+       or while the WebSocket is reconnecting) commands from control_light and
+       control_tv are always sent and only effect frames are skipped.
+
+    7. Call Observers
+       Callables in self.call_observers are called after every round of service calls
+       that reaches Home Assistant, as observer(calls, results, seconds). Status reads
+       are reported as a "get_state" call. The session recorder uses this to log HA
+       calls and their latency.
     """
     
-    def __init__(self, token):
-        """Initialize connection to Home Assistant"""
+    def __init__(self, token, use_websocket=True, shadow_max_age=60, client=None):
+        """
+        Initialize connection to Home Assistant
+        
+        Args:
+            token (str): Long-lived access token
+            use_websocket (bool): Send service calls over the WebSocket API (REST is used
+                                  while the connection is down, and for good if the
+                                  token is rejected)
+            shadow_max_age (float): Seconds a recorded device state is trusted
+                                    (None disables call suppression)
+            client: REST client to use instead of connecting to Home Assistant
+                    (e.g. a stand-in when replaying sessions)
+        """
         # Use the working Raspberry Pi IP address
         RASPBERRY_PI_IP = "192.168.0.171"  # Your Home Assistant IP
         
-        self.client = Client(f"http://{RASPBERRY_PI_IP}:8123/api", token)
+        self.client = client if client is not None else Client(f"http://{RASPBERRY_PI_IP}:8123/api", token)
+        self.ws = None
+        if use_websocket:
+            self.ws = HomeAssistantWebSocket(f"ws://{RASPBERRY_PI_IP}:8123/api/websocket", token)
+            # Keep the shadow state in sync with changes made outside this class
+            self.ws.subscribe_events("state_changed", self._on_state_changed)
+            self.ws.connection_observers.append(self._on_connection_changed)
+        
+        # Service calls queued by batch(), kept per thread
+        self._batch_state = threading.local()
+        
+        # Last confirmed device states, used to skip redundant calls
+        self.shadow = ShadowStateStore(max_age=shadow_max_age) if shadow_max_age is not None else None
+        
+        # Notified of every round of service calls (see section 7 above)
+        self.call_observers = []
         
         # Add a light name mapping for easier reference
         self.light_aliases = {
@@ -52,8 +123,197 @@ class SmartHomeControl:
         # Store the entity ID for easy reference
         self.wiz_entity_id = "light.wiz_rgbw_tunable_bd2b10"
         self.tv_entity_id = "remote.4ktv_jup"
+        
+        # Background engine for timed light effects
+        self.effects = LightEffectEngine(self.control_specific_light_frame)
     
-    def control_light(self, light_name, state, brightness=None, color=None):
+    def call_service(self, domain, service, data, force=False):
+        """
+        Call a Home Assistant service, or queue it if a batch is open on this thread
+        
+        Args:
+            domain (str): Service domain, e.g. "light"
+            service (str): Service name, e.g. "turn_on"
+            data (dict): Service data including "entity_id"
+            force (bool): Send the call even if the shadow state says it is redundant
+        
+        Returns:
+            The service result, or None if the call was queued or skipped
+        """
+        data = dict(data)
+        entity_ids = data.pop("entity_id", [])
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+        call = ServiceCall(domain, service, entity_ids, data)
+        
+        if force and self.shadow is not None:
+            for entity_id in entity_ids:
+                self.shadow.invalidate(entity_id)
+        
+        batch = getattr(self._batch_state, "batch", None)
+        if batch is not None:
+            batch.calls.append(call)
+            return None
+        
+        result = self.send_service_calls([call], merge=False)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def send_service_calls(self, calls, merge=True):
+        """
+        Send service calls, skipping targets the shadow state says are already set
+        
+        The shadow describes the state before these calls, so an entity that an
+        earlier call in the same list changes is never skipped afterwards.
+        
+        Args:
+            calls (list): ServiceCall objects
+            merge (bool): Merge calls to the same service with identical data
+        
+        Returns:
+            list: One entry per call; the result (None if skipped) or the exception
+                  raised for it
+        """
+        if self.shadow is None:
+            return self._send_service_calls(calls, merge)
+        
+        results = [None] * len(calls)
+        to_send = []
+        positions = []
+        # Entities changed by calls earlier in this list
+        touched = set()
+        for i, call in enumerate(calls):
+            remaining = [entity_id for entity_id in call.entity_ids
+                         if entity_id in touched
+                         or not self.shadow.call_is_redundant(call.domain, call.service,
+                                                              entity_id, call.service_data)]
+            touched.update(remaining)
+            skipped = len(call.entity_ids) - len(remaining)
+            self.shadow.stats["suppressed"] += skipped
+            if call.entity_ids and not remaining:
+                continue
+            to_send.append(ServiceCall(call.domain, call.service, remaining, call.service_data))
+            positions.append(i)
+        
+        if to_send:
+            self.shadow.stats["sent"] += len(to_send)
+            for i, call, result in zip(positions, to_send, self._send_service_calls(to_send, merge)):
+                results[i] = result
+                for entity_id in call.entity_ids:
+                    if isinstance(result, Exception):
+                        self.shadow.invalidate(entity_id)
+                    else:
+                        self.shadow.record_call(call.domain, call.service, entity_id, call.service_data)
+        return results
+
+    def shadow_is_live(self):
+        """Return True while state_changed events keep the shadow state up to date"""
+        ws = self.ws
+        return ws is not None and ws.is_connected()
+
+    def _on_state_changed(self, event):
+        if self.shadow is None:
+            return
+        data = event.get("data") or {}
+        new_state = data.get("new_state")
+        if new_state is None:
+            # The entity was removed
+            if data.get("entity_id"):
+                self.shadow.invalidate(data["entity_id"])
+            return
+        self.shadow.record_reported(new_state["entity_id"], new_state.get("state"),
+                                    new_state.get("attributes"))
+
+    def _on_connection_changed(self, connected):
+        # Events may have been missed while disconnected
+        if self.shadow is not None:
+            self.shadow.invalidate()
+
+    def _send_service_calls(self, calls, merge=True):
+        """Send service calls and notify the call observers"""
+        started = time.perf_counter()
+        results = self._transmit_service_calls(calls, merge)
+        self._notify_observers(calls, results, time.perf_counter() - started)
+        return results
+
+    def _notify_observers(self, calls, results, elapsed):
+        for observer in self.call_observers:
+            try:
+                observer(calls, results, elapsed)
+            except Exception as e:
+                print(f"Error in service call observer: {e}")
+
+    def _transmit_service_calls(self, calls, merge=True):
+        """Send service calls, over the WebSocket connection when available"""
+        # Read once: effect frames are sent from other threads
+        ws = self.ws
+        if ws is not None:
+            try:
+                ws.connect()
+                results = ws.call_services(calls, merge=merge)
+            except HomeAssistantAuthError as e:
+                # Retrying with the same token won't help
+                print(f"WebSocket authentication failed, using REST from now on: {e}")
+                self.ws = None
+            except ConnectionError as e:
+                # e.g. Home Assistant restarting; the client retries with backoff
+                ws.log(f"Using REST for this round: {e}")
+            else:
+                # Calls cut off by a dropped connection are sent again over REST
+                retry = [i for i, result in enumerate(results) if isinstance(result, ConnectionError)]
+                if retry:
+                    for i, result in zip(retry, self._send_rest_calls([calls[i] for i in retry], merge)):
+                        results[i] = result
+                return results
+        
+        return self._send_rest_calls(calls, merge)
+
+    def _send_rest_calls(self, calls, merge=True):
+        """Send service calls over the REST API; merged calls are still sent as one request each"""
+        if merge:
+            merged, mapping = merge_service_calls(calls)
+        else:
+            merged, mapping = list(calls), list(range(len(calls)))
+        outcomes = []
+        for call in merged:
+            try:
+                json_data = dict(call.service_data)
+                if call.entity_ids:
+                    json_data["entity_id"] = call.entity_ids if len(call.entity_ids) > 1 else call.entity_ids[0]
+                outcomes.append(self.client.request(
+                    method="post",
+                    path=f"services/{call.domain}/{call.service}",
+                    json=json_data
+                ))
+            except Exception as e:
+                outcomes.append(e)
+        return [outcomes[index] for index in mapping]
+
+    @contextmanager
+    def batch(self):
+        """
+        Queue service calls made on this thread and send them together on exit
+        
+        Yields:
+            ServiceCallBatch: Collects the queued calls; after the block, results
+                              and errors hold the outcome of each call
+        """
+        outer = getattr(self._batch_state, "batch", None)
+        if outer is not None:
+            # Nested batches join the outer one
+            yield outer
+            return
+        
+        batch = ServiceCallBatch(self)
+        self._batch_state.batch = batch
+        try:
+            yield batch
+        finally:
+            self._batch_state.batch = None
+            batch.flush()
+
+    def control_light(self, light_name, state, brightness=None, color=None, transition=None):
         """
         Control the WiZ light using name or alias
         
@@ -62,14 +322,71 @@ class SmartHomeControl:
             state (str): "on" or "off"
             brightness (int, optional): 0-100 (will be converted to 0-255)
             color (tuple, optional): (hue: 0-360, saturation: 0-100)
+            transition (float, optional): Fade time in seconds
         
         Returns:
             str: Status message
         """
-        # This is a simplified wrapper for the control_specific_light method
-        return self.control_specific_light(light_name, state, brightness, color)
+        # A direct command replaces any effect running on the light
+        self.effects.cancel(self.light_aliases.get(light_name, light_name))
+        
+        # This is a simplified wrapper for the control_specific_light method.
+        # Without state events the shadow may be out of date, so user commands
+        # are always sent
+        return self.control_specific_light(light_name, state, brightness, color, transition,
+                                           force=not self.shadow_is_live())
+
+    def run_light_effect(self, light_name, effect, repeat=None, color=None, brightness=None):
+        """
+        Run a light effect in the background
+        
+        Args:
+            light_name (str): Name or alias of the light ("wiz", "rgb")
+            effect (str or list): Preset name or a list of LightFrame objects
+            repeat (int, optional): Times to play the effect (0 loops until replaced)
+            color (tuple, optional): (hue: 0-360, saturation: 0-100) for presets
+            brightness (int, optional): 0-100 for presets
+        
+        Returns:
+            str: Status message
+        """
+        if isinstance(effect, str):
+            preset = build_effect(effect, color=color, brightness=brightness)
+            if preset is None:
+                return f"Unknown light effect: {effect}"
+            frames, default_repeat = preset
+            effect_name = effect
+        else:
+            frames, default_repeat = effect, 1
+            effect_name = f"{len(frames)}-frame sequence"
+        
+        if repeat is None:
+            repeat = default_repeat
+        
+        self.effects.start(self.light_aliases.get(light_name, light_name), frames, repeat)
+        return f"Started {effect_name} effect on {light_name}"
 
-    def control_specific_light(self, light_name, state, brightness=None, color=None):
+    def stop_light_effect(self, light_name):
+        """
+        Stop the effect running on a light, leaving the light in its current state
+        
+        Args:
+            light_name (str): Name or alias of the light
+        
+        Returns:
+            str: Status message
+        """
+        if self.effects.cancel(self.light_aliases.get(light_name, light_name)):
+            return f"Stopped effect on {light_name}"
+        return f"No effect running on {light_name}"
+
+    def control_specific_light_frame(self, light_name, frame):
+        """Apply a single LightFrame from the effect engine"""
+        return self.control_specific_light(light_name, frame.state, frame.brightness,
+                                           frame.color, frame.transition or None)
+
+    def control_specific_light(self, light_name, state, brightness=None, color=None, transition=None,
+                               force=False):
         """Control a specific light by entity ID or alias"""
         try:
             # Convert alias to actual entity ID if it exists in the mapping
@@ -80,11 +397,10 @@ class SmartHomeControl:
             entity_id = f"light.{light_name}" if not light_name.startswith("light.") else light_name
             
             if state == "off":
-                self.client.request(
-                    method="post",
-                    path="services/light/turn_off",
-                    json={"entity_id": entity_id}
-                )
+                data = {"entity_id": entity_id}
+                if transition is not None:
+                    data["transition"] = transition
+                self.call_service("light", "turn_off", data, force=force)
                 return f"Turned off {light_name}"
             
             elif state == "on":
@@ -102,11 +418,11 @@ class SmartHomeControl:
                     # Home Assistant expects HSL values
                     data["hs_color"] = [hue, saturation]
                 
-                self.client.request(
-                    method="post",
-                    path="services/light/turn_on",
-                    json=data
-                )
+                # Let Home Assistant fade to the new state
+                if transition is not None:
+                    data["transition"] = transition
+                
+                self.call_service("light", "turn_on", data, force=force)
                 
                 status_msg = f"Turned on {light_name}"
                 if brightness is not None:
@@ -129,20 +445,14 @@ class SmartHomeControl:
             str: Status message
         """
         try:
+            # See control_light
+            force = not self.shadow_is_live()
             if action.lower() == "on":
-                self.client.request(
-                    method="post",
-                    path="services/remote/turn_on",
-                    json={"entity_id": self.tv_entity_id}
-                )
+                self.call_service("remote", "turn_on", {"entity_id": self.tv_entity_id}, force=force)
                 return f"Turned on TV"
             
             elif action.lower() == "off":
-                self.client.request(
-                    method="post",
-                    path="services/remote/turn_off",
-                    json={"entity_id": self.tv_entity_id}
-                )
+                self.call_service("remote", "turn_off", {"entity_id": self.tv_entity_id}, force=force)
                 return f"Turned off TV"
             
             else:
@@ -159,8 +469,20 @@ class SmartHomeControl:
             dict: Current state and attributes of the WiZ light
         """
         try:
+            # Send queued commands first so the status reflects them
+            batch = getattr(self._batch_state, "batch", None)
+            if batch is not None:
+                batch.flush()
+            
             # Get the state of the WiZ light
+            started = time.perf_counter()
             light = self.client.get_state(entity_id=self.wiz_entity_id)
+            self._notify_observers([ServiceCall("homeassistant", "get_state", [self.wiz_entity_id], {})],
+                                   [light], time.perf_counter() - started)
+            
+            # The real state refreshes the shadow
+            if self.shadow is not None:
+                self.shadow.record_reported(self.wiz_entity_id, light.state, light.attributes)
             
             # Format and return the status
             status = {
@@ -176,6 +498,26 @@ class SmartHomeControl:
         except Exception as e:
             return f"Error getting status: {str(e)}"
 
+class ServiceCallBatch:
+    """Service calls queued by SmartHomeControl.batch()"""
+    
+    def __init__(self, home_control):
+        self.home_control = home_control
+        self.calls = []
+        self.results = []
+        self.errors = []
+    
+    def flush(self):
+        """Send the queued calls and record their outcomes"""
+        if not self.calls:
+            return
+        calls, self.calls = self.calls, []
+        for call, result in zip(calls, self.home_control.send_service_calls(calls)):
+            self.results.append(result)
+            if isinstance(result, Exception):
+                self.errors.append(f"Error calling {call.domain}.{call.service} "
+                                   f"for {', '.join(call.entity_ids)}: {result}")
+
 # Test the controls for the WiZ light only
 def test_controls():
     TOKEN = ""